@@ -2,43 +2,23 @@ import streamlit as st
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
+import numpy as np
 from datetime import datetime, date, timedelta
 from hijri_converter import Gregorian
-import io, os, json
+import json, functools
 import streamlit.components.v1 as components
+from finance_engine import (
+    DAILY_CATS, INCOME_CATS, FIXED_CATS, CUSTOM_COMPARE_LIST, TREND_RESOLUTIONS, TREND_MAX_POINTS,
+    LedgerWriter, query_ledger, full_ledger, hot_cycles,
+    cycle_key, get_cycle_range, rollup_totals, rollup_daily_spend, rollup_by_category, rollup_pivot,
+    ledger_filter, ledger_page, page_count, editor_changes, import_ledger, trend_series, lttb,
+    CycleAnalytics, get_fiscal_cycle,
+    PROFILE_LOG, begin_run, end_run, timed, profiled, profile_runs, profile_summary,
+)
 
 # --- 1. الإعدادات ---
 st.set_page_config(page_title="المستشار المالي 2026 - v69", layout="wide")
 
-DB_FILE = "finance_master_2026.csv"
-CONFIG_FILE = "app_config_persistent.json"
-
-DAILY_CATS = ["بنزين", "ماء", "الزيت", "الغاز", "السيارة", "تصليح", "فواتير", "مقاضي البيت", "مقاهي", "خضاروفواكهه", "مخالفات", "مقاضي البنات", "المستشفيات والصيدليات", "مطاعم", "ترفيه وحجوزات", "خدمات خارجية", "قطات", "عناية", "أخرى"]
-INCOME_CATS = ["الراتب", "حساب المواطن", "الدعم السكني", "الاسهم", "مسترجعات", "حقوق خاصة", "العمالة", "انتداب", "اركابات", "أخرى"]
-FIXED_CATS = ["القرض الشخصي", "القرض", "القرض العقاري", "امي", "كفالة", "الاعاشة"]
-
-CUSTOM_COMPARE_LIST = ["أمي", "الاعاشة", "اركابات", "الاسهم", "الدعم السكني", "الراتب", "السيارة", "العمالة", "القرض الشخصي", "القرض العقاري", "المستشفيات والصيدليات", "بنزين", "ترفيه وحجوزات", "تصليح", "انتداب", "حساب المواطن", "خدمات خارجية", "خضار وفواكه", "ديون", "زكاة", "عناية", "فواتير", "قطات", "كفالة", "مخالفات", "مسترجعات", "مطاعم", "مقاضي البيت", "مقاضي البنات", "مقاهي وكفيهات"]
-
-# --- دوال الحفظ والتحميل ---
-def load_config():
-    if os.path.exists(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-                return json.load(f)
-        except:
-            return {"goal": 5000, "services": {}}
-    return {"goal": 5000, "services": {}}
-
-def save_config(config):
-    try:
-        with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-            json.dump(config, f, ensure_ascii=False, indent=4)
-    except Exception as e:
-        st.error(f"حدث خطأ أثناء حفظ الإعدادات: {e}")
-
-if 'app_config' not in st.session_state:
-    st.session_state.app_config = load_config()
-
 # --- 2. الحماية ---
 if 'authenticated' not in st.session_state: st.session_state.authenticated = False
 if not st.session_state.authenticated:
@@ -50,44 +30,81 @@ if not st.session_state.authenticated:
             st.rerun()
     st.stop()
 
-# --- 3. المحرك ---
-def get_salary_day(year, month):
-    try:
-        t_27 = date(int(year), int(month), 27)
-        return 26 if t_27.weekday() == 4 else (28 if t_27.weekday() == 5 else 27)
-    except: return 27
-
-def get_fiscal_cycle(dt):
-    if pd.isna(dt): return "None"
-    sd = get_salary_day(dt.year, dt.month)
-    if dt.day >= sd: return (dt + pd.DateOffset(months=1)).strftime("%m-%Y")
-    return dt.strftime("%m-%Y")
-
-def get_cycle_range(cycle_str):
-    try:
-        month, year = map(int, cycle_str.split('-'))
-        curr_month_start = date(year, month, 1)
-        prev_month_end = curr_month_start - timedelta(days=1)
-        start_day = get_salary_day(prev_month_end.year, prev_month_end.month)
-        start_date = date(prev_month_end.year, prev_month_end.month, start_day)
-        end_day = get_salary_day(year, month)
-        end_date = date(year, month, end_day) - timedelta(days=1)
-        return start_date, end_date
-    except: return None, None
-
-def load_data():
-    if os.path.exists(DB_FILE):
-        try:
-            df = pd.read_csv(DB_FILE)
-            df['التاريخ'] = pd.to_datetime(df['التاريخ'], errors='coerce')
-            df['المبلغ'] = pd.to_numeric(df['المبلغ'], errors='coerce').fillna(0)
-            return df.dropna(subset=['التاريخ']).reset_index(drop=True)
-        except: pass
-    return pd.DataFrame(columns=['التاريخ', 'اليوم', 'النوع', 'التصنيف', 'المبلغ', 'التفاصيل'])
-
-def save_data(df): df.to_csv(DB_FILE, index=False, encoding='utf-8-sig')
-
-if 'df' not in st.session_state: st.session_state.df = load_data()
+# --- قياس الأداء: كل تشغيل كامل يُسجل باسم "app"، وإعادة تشغيل أي جزء وحده تُسجل باسم ذلك الجزء (root=True) ---
+# التشغيل الذي قطعه st.rerun (بعد حفظ مثلاً) يُغلق هنا في التشغيل التالي
+if 'profile_run' in st.session_state: end_run(st.session_state.pop('profile_run'), "rerun")
+st.session_state.profile_run = begin_run("app")
+
+# --- 3. المحرك (الحسابات والتخزين في finance_engine.py) ---
+# كاتب واحد لكل عملية يملك السجل والإعدادات: الجلسات تقرأ منه وترسل التعديلات إلى طابوره
+@st.cache_resource
+def get_writer(): return LedgerWriter()
+
+def get_ledger(): return get_writer().ledger
+
+def app_config(): return get_writer().config
+
+def save_config(patch, replace=False):
+    try: get_writer().update_config(patch, replace)
+    except Exception as e: st.error(f"حدث خطأ أثناء حفظ الإعدادات: {e}")
+
+SYNC_SECONDS = 5
+
+@st.fragment(run_every=SYNC_SECONDS)
+def live_sync():
+    # إن كتبت جلسة أخرى (أو عملية خادم أخرى) منذ آخر رسم كامل، يُعاد رسم الصفحة لتعرض البيانات الجديدة
+    writer = get_writer()
+    writer.sync()
+    if writer.version != st.session_state.get('seen_version'): st.rerun()
+
+# التوقعات والعمليات غير المعتادة تُحسب في عملية خلفية؛ الصفحة تعرض آخر نتيجة مكتملة ولا تنتظر
+@st.cache_resource
+def get_analytics(): return CycleAnalytics()
+
+@st.fragment(run_every=2)
+def analytics_poll(cycle, version):
+    # يُرسم فقط أثناء الحساب، ويعيد رسم الصفحة حين تكتمل النتيجة
+    if not get_analytics().pending(cycle, version): st.rerun()
+
+def cycle_forecast(cycle):
+    ledger = get_ledger()
+    forecast, fresh = get_analytics().get(ledger, cycle)
+    if not fresh: analytics_poll(cycle, ledger.version)
+    return forecast, fresh
+
+IMPORT_MODES = {"دمج (تجاهل المكرر)": "merge", "إضافة الكل": "append", "استبدال السجل": "replace"}
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def trend_figure(target, resolution, chart_type, version):
+    # الرسم يُخزَّن لكل (بند، دقة، شكل) ونسخة البيانات، فتغيير الشكل لا يعيد التجميع إلا أول مرة
+    item_df = query_ledger(get_ledger(), category=target)
+    if item_df.empty: return None
+    x, y = trend_series(item_df, resolution)
+    # القمة والقاع من السلسلة الكاملة قبل التقليل، ثم يُضمن بقاؤهما ضمن النقاط المرسومة
+    i_mx, i_mn = int(np.argmax(y)), int(np.argmin(y))
+    mx, mn = y[i_mx], y[i_mn]
+    pos = np.arange(len(y)) if resolution == "دورة مالية" else np.asarray(x, dtype='datetime64[ns]').astype(np.int64)
+    idx = np.union1d(lttb(pos, y, TREND_MAX_POINTS), [i_mx, i_mn])
+    px_, py_ = x[idx], y[idx]
+    fig = go.Figure()
+    
+    if chart_type == "خطي انسيابي":
+        fig.add_trace(go.Scatter(x=px_, y=py_, mode='lines+markers', line=dict(color='#3b82f6', width=5, shape='spline'), marker=dict(size=10, color='white', line=dict(width=2, color='#3b82f6'))))
+    elif chart_type == "أعمدة (Bar)":
+        fig.add_trace(go.Bar(x=px_, y=py_, marker_color='#3b82f6'))
+    elif chart_type == "مساحي (Area)":
+        fig.add_trace(go.Scatter(x=px_, y=py_, mode='lines+markers', fill='tozeroy', line=dict(color='#3b82f6', width=3), marker=dict(size=8, color='white', line=dict(width=2, color='#3b82f6'))))
+    elif chart_type == "خطي متدرج (Step)":
+        fig.add_trace(go.Scatter(x=px_, y=py_, mode='lines+markers', line=dict(color='#3b82f6', width=4, shape='hv'), marker=dict(size=8, color='white', line=dict(width=2, color='#3b82f6'))))
+    elif chart_type == "نقاط (Scatter)":
+        fig.add_trace(go.Scatter(x=px_, y=py_, mode='markers', marker=dict(size=14, color='#3b82f6', line=dict(width=2, color='white'))))
+    
+    fig.add_annotation(x=x[i_mx], y=mx, text=f"<b>قمة: {mx:,.2f}</b>", showarrow=True, arrowhead=2, arrowsize=1.5, arrowwidth=3, arrowcolor="black", ax=0, ay=-60, font=dict(color="black", size=16, family="Arial Black"), bgcolor="white", bordercolor="black", borderwidth=2)
+    fig.add_annotation(x=x[i_mn], y=mn, text=f"<b>قاع: {mn:,.2f}</b>", showarrow=True, arrowhead=2, arrowsize=1.5, arrowwidth=3, arrowcolor="black", ax=0, ay=60, font=dict(color="black", size=16, family="Arial Black"), bgcolor="white", bordercolor="black", borderwidth=2)
+    
+    fig.update_layout(template="plotly_dark", height=500)
+    if len(idx) < len(y): fig.update_layout(title=f"{len(idx):,} نقطة من {len(y):,} (تقليل مع الحفاظ على الشكل)")
+    return fig
 
 # --- 4. الستايل وتاريخ اليوم ---
 st.markdown("""
@@ -151,94 +168,138 @@ st.markdown(f"""<div style="background:#0f172a; padding:20px; border-radius:15px
 components.html("<script>function update(){const n=new Date();window.parent.document.getElementById('live_clock_v69').innerHTML=n.toLocaleTimeString('en-GB',{hour12:false});}setInterval(update,1000);update();</script>", height=0)
 
 # --- 5. المنطق ---
-df = st.session_state.df
-if not df.empty: df['دورة_الميزانية'] = df['التاريخ'].apply(get_fiscal_cycle)
-
-tabs = st.tabs(["📊 الرئيسية", "🛒 إضافة مصروفات (شامل)", "💰 دخل وثوابت", "🔄 مقارنات وترند", "⚙️ النسخ الاحتياطي"])
+# كل تبويب ولوحاته الفرعية أجزاء مستقلة (st.fragment): تفاعل عنصر داخل لوحة يعيد تشغيل تلك اللوحة فقط،
+# والتبويب غير الظاهر لا يُبنى أصلاً (tabs مع on_change="rerun" و .open)
 
 # --- Tab 1: الرئيسية ---
-with tabs[0]:
-    if not df.empty:
-        in_all = df[df['النوع'].isin(['دخل', 'الدخل'])]['المبلغ'].sum()
-        out_all = df[~df['النوع'].isin(['دخل', 'الدخل'])]['المبلغ'].sum()
-        net_savings = in_all - out_all
+@st.fragment
+@profiled("home_tab", root=True)
+def home_tab():
+    ledger = get_ledger()
+    if ledger.frame.empty and ledger.archive.empty: return
+    cycles = ledger.cycles()
+    sel_cycle = st.selectbox("📅 الدورة الشهرية:", cycles)
+    # دورة من سنة مؤرشفة تُحمّل الآن فقط، والأرقام الكلية من ملخصات الأرشيف دون قراءة صفوفه
+    get_writer().load_cycles([sel_cycle])
+    roll = ledger.rollup()
+    in_all, out_all = ledger.all_time_totals()
+    net_savings = in_all - out_all
+    
+    m_inc, m_exp = rollup_totals(roll, sel_cycle)
+    m_rem = m_inc - m_exp
+    forecast, fresh = cycle_forecast(sel_cycle)
+
+    c1, c2, c3, c4 = st.columns(4)
+    
+    with c1:
+        st.markdown(f"""<div class='card-container' style='background:#bfdbfe;'><div class='card-icon'>💰</div><div class='text-content'><div class='card-title'>إجمالي الدخل</div><div class='val-stroke-white'>{m_inc:,.2f}</div></div></div>""", unsafe_allow_html=True)
         
-        cycles = sorted([c for c in df['دورة_الميزانية'].unique() if c != "None"], key=lambda x: datetime.strptime(x, "%m-%Y"), reverse=True)
-        sel_cycle = st.selectbox("📅 الدورة الشهرية:", cycles)
-        curr_df = df[df['دورة_الميزانية'] == sel_cycle]
+    with c2:
+        st.markdown(f"""<div class='card-container' style='background:#e9d5ff;'><div class='card-icon'>💸</div><div class='text-content'><div class='card-title'>مصروفات الشهر</div><div class='val-stroke-white'>{m_exp:,.2f}</div></div></div>""", unsafe_allow_html=True)
         
-        m_inc = curr_df[curr_df['النوع'].isin(['دخل', 'الدخل'])]['المبلغ'].sum()
-        m_exp = curr_df[~curr_df['النوع'].isin(['دخل', 'الدخل'])]['المبلغ'].sum()
-        m_rem = m_inc - m_exp
-
-        c1, c2, c3, c4 = st.columns(4)
+    with c3:
+        cls = "val-stroke-green" if m_rem >= 0 else "val-stroke-red"
+        if m_rem < 0:
+            st.markdown(f"""<div class='card-container'><div class='card-icon'>⚖️</div><div class='text-content'><div class='card-title'>المتبقي الشهري</div><div class='{cls}'>{m_rem:,.2f}</div><div class='warn-badge'>⚠️ عجز!</div></div></div>""", unsafe_allow_html=True)
+        else:
+            st.markdown(f"""<div class='card-container'><div class='card-icon'>⚖️</div><div class='text-content'><div class='card-title'>المتبقي الشهري</div><div class='{cls}'>{m_rem:,.2f}</div></div></div>""", unsafe_allow_html=True)
         
-        with c1:
-            st.markdown(f"""<div class='card-container' style='background:#bfdbfe;'><div class='card-icon'>💰</div><div class='text-content'><div class='card-title'>إجمالي الدخل</div><div class='val-stroke-white'>{m_inc:,.2f}</div></div></div>""", unsafe_allow_html=True)
-            
-        with c2:
-            st.markdown(f"""<div class='card-container' style='background:#e9d5ff;'><div class='card-icon'>💸</div><div class='text-content'><div class='card-title'>مصروفات الشهر</div><div class='val-stroke-white'>{m_exp:,.2f}</div></div></div>""", unsafe_allow_html=True)
-            
-        with c3:
-            cls = "val-stroke-green" if m_rem >= 0 else "val-stroke-red"
-            if m_rem < 0:
-                st.markdown(f"""<div class='card-container'><div class='card-icon'>⚖️</div><div class='text-content'><div class='card-title'>المتبقي الشهري</div><div class='{cls}'>{m_rem:,.2f}</div><div class='warn-badge'>⚠️ عجز!</div></div></div>""", unsafe_allow_html=True)
-            else:
-                st.markdown(f"""<div class='card-container'><div class='card-icon'>⚖️</div><div class='text-content'><div class='card-title'>المتبقي الشهري</div><div class='{cls}'>{m_rem:,.2f}</div></div></div>""", unsafe_allow_html=True)
-            
-        with c4:
-            cls_n = "val-stroke-green" if net_savings >= 0 else "val-stroke-red"
-            if net_savings < 0:
-                st.markdown(f"""<div class='card-container'><div class='card-icon'>🏦</div><div class='text-content'><div class='card-title'>صافي المدخرات</div><div class='{cls_n}'>{net_savings:,.2f}</div><div class='warn-badge'>⚠️ سالب!</div></div></div>""", unsafe_allow_html=True)
-            else:
-                st.markdown(f"""<div class='card-container'><div class='card-icon'>🏦</div><div class='text-content'><div class='card-title'>صافي المدخرات</div><div class='{cls_n}'>{net_savings:,.2f}</div></div></div>""", unsafe_allow_html=True)
+    with c4:
+        cls_n = "val-stroke-green" if net_savings >= 0 else "val-stroke-red"
+        if net_savings < 0:
+            st.markdown(f"""<div class='card-container'><div class='card-icon'>🏦</div><div class='text-content'><div class='card-title'>صافي المدخرات</div><div class='{cls_n}'>{net_savings:,.2f}</div><div class='warn-badge'>⚠️ سالب!</div></div></div>""", unsafe_allow_html=True)
+        else:
+            st.markdown(f"""<div class='card-container'><div class='card-icon'>🏦</div><div class='text-content'><div class='card-title'>صافي المدخرات</div><div class='{cls_n}'>{net_savings:,.2f}</div></div></div>""", unsafe_allow_html=True)
 
-        st.divider()
-        cw, cg, co, cgl = st.columns(4)
-        for name, icon, col in [("ماء", "💧", cw), ("الغاز", "🔥", cg), ("الزيت", "🛢️", co)]:
-            svc_data = st.session_state.app_config.get("services", {}).get(name, {"date": "---", "note": "---"})
-            with col:
-                st.markdown(f"""<div class='svc-box'><h2 style='color:white; margin:0;'>{icon} {name}</h2><div class='note-text'>📅 {svc_data['date']}<br>📝 {svc_data['note']}</div></div>""", unsafe_allow_html=True)
-                with st.popover(f"تعديل {name}"):
-                    d_n = st.date_input("التاريخ", date.today(), key=f"d_{name}")
-                    n_n = st.text_input("تفاصيل", value=svc_data['note'], key=f"n_{name}")
-                    if st.button("حفظ الملحوظة", key=f"b_{name}"):
-                        if "services" not in st.session_state.app_config: st.session_state.app_config["services"] = {}
-                        st.session_state.app_config["services"][name] = {"date": d_n.strftime('%Y-%m-%d'), "note": n_n}
-                        save_config(st.session_state.app_config); st.rerun()
-        
-        with cgl:
-            cur_g = st.session_state.app_config.get("goal", 5000)
-            g_clr = "#22c55e" if m_rem >= cur_g else "#ef4444"
-            st.markdown(f"""<div class='svc-box' style='border-color:{g_clr};'><h2 style='color:white; margin:0;'>🎯 الهدف</h2><h2 style='color:{g_clr}; margin:5px 0;'>{m_rem:,.0f} / {cur_g:,.0f}</h2></div>""", unsafe_allow_html=True)
-            with st.popover("تعديل الهدف"):
-                new_g = st.number_input("الهدف الجديد", value=cur_g, step=500)
-                if st.button("حفظ الهدف"): st.session_state.app_config["goal"] = new_g; save_config(st.session_state.app_config); st.rerun()
+    st.divider()
+    services_panel(m_rem, forecast["projected_remaining"] if forecast else None)
 
-        st.divider()
-        daily_spend = curr_df[~curr_df['النوع'].isin(['دخل', 'الدخل'])].groupby(curr_df['التاريخ'].dt.date)['المبلغ'].sum()
-        ch, cl, cz = st.columns(3)
-        start_d, end_d = get_cycle_range(sel_cycle)
-        zero_days = 0
-        if start_d and end_d:
-            total_days = (end_d - start_d).days + 1
-            zero_days = max(0, total_days - len(daily_spend))
-
-        if not daily_spend.empty:
-            with ch: st.markdown(f"<div style='background:linear-gradient(45deg, #991b1b, #ef4444); padding:10px; border-radius:10px; text-align:center; color:white;'>🔺 الأعلى صرفاً<br><b>{daily_spend.max():,.2f}</b> ({daily_spend.idxmax()})</div>", unsafe_allow_html=True)
-            with cl: st.markdown(f"<div style='background:linear-gradient(45deg, #065f46, #10b981); padding:10px; border-radius:10px; text-align:center; color:white;'>🔻 الأدنى صرفاً<br><b>{daily_spend.min():,.2f}</b> ({daily_spend.idxmin()})</div>", unsafe_allow_html=True)
-        with cz: st.markdown(f"<div style='background:linear-gradient(45deg, #1e40af, #3b82f6); padding:10px; border-radius:10px; text-align:center; color:white;'>✨ أيام بلا صرف<br><b>{zero_days}</b> يوم</div>", unsafe_allow_html=True)
+    st.divider()
+    daily_spend = rollup_daily_spend(roll, sel_cycle)
+    ch, cl, cz = st.columns(3)
+    start_d, end_d = get_cycle_range(sel_cycle)
+    zero_days = 0
+    if start_d and end_d:
+        total_days = (end_d - start_d).days + 1
+        zero_days = max(0, total_days - len(daily_spend))
+
+    if not daily_spend.empty:
+        with ch: st.markdown(f"<div style='background:linear-gradient(45deg, #991b1b, #ef4444); padding:10px; border-radius:10px; text-align:center; color:white;'>🔺 الأعلى صرفاً<br><b>{daily_spend.max():,.2f}</b> ({daily_spend.idxmax()})</div>", unsafe_allow_html=True)
+        with cl: st.markdown(f"<div style='background:linear-gradient(45deg, #065f46, #10b981); padding:10px; border-radius:10px; text-align:center; color:white;'>🔻 الأدنى صرفاً<br><b>{daily_spend.min():,.2f}</b> ({daily_spend.idxmin()})</div>", unsafe_allow_html=True)
+    with cz: st.markdown(f"<div style='background:linear-gradient(45deg, #1e40af, #3b82f6); padding:10px; border-radius:10px; text-align:center; color:white;'>✨ أيام بلا صرف<br><b>{zero_days}</b> يوم</div>", unsafe_allow_html=True)
 
-        st.divider()
-        st.write(f"### 📊 إحصائيات {sel_cycle}")
-        cp, cl = st.columns([1, 1.5])
-        with cp:
-            if not curr_df[~curr_df['النوع'].isin(['دخل', 'الدخل'])].empty:
-                st.plotly_chart(px.pie(curr_df[~curr_df['النوع'].isin(['دخل', 'الدخل'])], values='المبلغ', names='التصنيف', hole=0.5, template="plotly_dark"), use_container_width=True)
-        with cl: st.dataframe(curr_df.sort_values('التاريخ', ascending=False), use_container_width=True)
+    st.divider()
+    forecast_panel(forecast, fresh)
+
+    st.divider()
+    st.write(f"### 📊 إحصائيات {sel_cycle}")
+    cp, cl = st.columns([1, 1.5])
+    with cp:
+        cat_spend = rollup_by_category(roll, sel_cycle, income=False)
+        if not cat_spend.empty:
+            with timed("home.pie"): st.plotly_chart(px.pie(cat_spend.reset_index(), values='المبلغ', names='التصنيف', hole=0.5, template="plotly_dark"), use_container_width=True)
+    with cl: cycle_table(sel_cycle)
+
+@st.fragment
+@profiled("services_panel", root=True)
+def services_panel(m_rem, projected=None):
+    # تعديل ملحوظة أو الهدف يعيد رسم هذه اللوحة فقط
+    cw, cg, co, cgl = st.columns(4)
+    for name, icon, col in [("ماء", "💧", cw), ("الغاز", "🔥", cg), ("الزيت", "🛢️", co)]:
+        svc_data = app_config().get("services", {}).get(name, {"date": "---", "note": "---"})
+        with col:
+            st.markdown(f"""<div class='svc-box'><h2 style='color:white; margin:0;'>{icon} {name}</h2><div class='note-text'>📅 {svc_data['date']}<br>📝 {svc_data['note']}</div></div>""", unsafe_allow_html=True)
+            with st.popover(f"تعديل {name}"):
+                d_n = st.date_input("التاريخ", date.today(), key=f"d_{name}")
+                n_n = st.text_input("تفاصيل", value=svc_data['note'], key=f"n_{name}")
+                if st.button("حفظ الملحوظة", key=f"b_{name}"):
+                    # تُرسل الملحوظة وحدها فلا تمسح ما حفظته جلسة أخرى في الوقت نفسه
+                    save_config({"services": {name: {"date": d_n.strftime('%Y-%m-%d'), "note": n_n}}}); st.rerun(scope="fragment")
+    
+    with cgl:
+        cur_g = app_config().get("goal", 5000)
+        g_clr = "#22c55e" if m_rem >= cur_g else "#ef4444"
+        st.markdown(f"""<div class='svc-box' style='border-color:{g_clr};'><h2 style='color:white; margin:0;'>🎯 الهدف</h2><h2 style='color:{g_clr}; margin:5px 0;'>{m_rem:,.0f} / {cur_g:,.0f}</h2>{f"<div class='note-text'>📈 المتوقع نهاية الدورة: {projected:,.0f}</div>" if projected is not None else ""}</div>""", unsafe_allow_html=True)
+        with st.popover("تعديل الهدف"):
+            new_g = st.number_input("الهدف الجديد", value=cur_g, step=500)
+            if st.button("حفظ الهدف"): save_config({"goal": new_g}); st.rerun(scope="fragment")
+
+@profiled("forecast_panel")
+def forecast_panel(forecast, fresh):
+    if forecast is None:
+        st.caption("⏳ جارٍ حساب توقعات الدورة في الخلفية..."); return
+    goal = app_config().get("goal", 5000)
+    p_rem = forecast["projected_remaining"]
+    cf1, cf2 = st.columns(2)
+    with cf1:
+        st.markdown(f"""<div class='card-container'><div class='card-icon'>📈</div><div class='text-content'><div class='card-title'>المصروف المتوقع نهاية الدورة</div><div class='val-stroke-white'>{forecast['projected_expense']:,.2f}</div></div></div>""", unsafe_allow_html=True)
+    with cf2:
+        cls = "val-stroke-green" if p_rem >= goal else "val-stroke-red"
+        badge = "" if p_rem >= goal else f"<div class='warn-badge'>⚠️ أقل من الهدف بـ {goal - p_rem:,.0f}</div>"
+        st.markdown(f"""<div class='card-container'><div class='card-icon'>🔮</div><div class='text-content'><div class='card-title'>المتبقي المتوقع / الهدف {goal:,.0f}</div><div class='{cls}'>{p_rem:,.2f}</div>{badge}</div></div>""", unsafe_allow_html=True)
+    cats, anomalies = forecast["categories"], forecast["anomalies"]
+    with st.expander(f"🔮 توقعات البنود اليومية ({len(cats)}) والعمليات غير المعتادة ({len(anomalies)})"):
+        st.dataframe(cats.style.format("{:,.2f}", na_rep="—"), use_container_width=True)
+        if not anomalies.empty:
+            st.write("⚠️ عمليات أكبر بكثير من المعتاد للبند:")
+            st.dataframe(anomalies.style.format({"المبلغ": "{:,.2f}", "الوسيط المعتاد": "{:,.2f}", "الانحراف": "{:.1f}", "التاريخ": "{:%Y-%m-%d}"}), use_container_width=True, hide_index=True)
+    st.caption(f"آخر حساب {forecast['computed_at']:%H:%M:%S} — اليوم {forecast['elapsed_days']} من {forecast['total_days']}" + ("" if fresh else " — يجري تحديثه للبيانات الجديدة"))
+
+@st.fragment
+@profiled("cycle_table", root=True)
+def cycle_table(sel_cycle):
+    # التنقل بين صفحات الجدول لا يعيد بناء البطاقات والرسم الدائري
+    df = get_ledger().frame
+    cyc_ids = ledger_filter(df, cycle=sel_cycle, descending=True)
+    cyc_page = st.number_input("الصفحة", min_value=1, max_value=page_count(cyc_ids), value=1, step=1, key="cycle_page")
+    page = ledger_page(df, cyc_ids, cyc_page - 1)
+    with timed("cycle_table.payload") as rec:
+        rec["bytes"] = int(page.memory_usage(deep=True).sum())
+        st.dataframe(page, use_container_width=True)
 
 # --- Tab 2: إضافة مصروفات متعددة ---
-with tabs[1]:
+@profiled("bulk_tab")
+def bulk_tab():
     st.subheader("🛒 تسجيل مصروفات متعددة (شامل)")
     with st.form("bulk_expense_form", clear_on_submit=True):
         col_date, col_submit = st.columns([1, 3])
@@ -255,119 +316,239 @@ with tabs[1]:
                 if amount > 0:
                     new_rows.append({"التاريخ": pd.to_datetime(entry_date), "اليوم": d_name, "النوع": "مصروف", "التصنيف": cat, "المبلغ": amount, "التفاصيل": "إدخال متعدد"})
             if new_rows:
-                st.session_state.df = pd.concat([st.session_state.df, pd.DataFrame(new_rows)], ignore_index=True)
-                save_data(st.session_state.df); st.success(f"✅ تم إضافة {len(new_rows)} عمليات بنجاح! وتم تصفير الخانات."); st.rerun()
+                get_writer().append(new_rows)
+                st.success(f"✅ تم إضافة {len(new_rows)} عمليات بنجاح! وتم تصفير الخانات."); st.rerun()
             else: st.warning("⚠️ الرجاء تعبئة خانة واحدة على الأقل.")
 
 # --- Tab 4: المقارنات والترند ---
-with tabs[3]:
-    if not df.empty:
-        st.subheader("📈 مسار الترند")
-        
-        col_t1, col_t2 = st.columns(2)
-        with col_t1: target = st.selectbox("🔍 اختر البند:", CUSTOM_COMPARE_LIST)
-        with col_t2: chart_type = st.selectbox("📊 شكل الرسم البياني:", ["خطي انسيابي", "أعمدة (Bar)", "مساحي (Area)", "خطي متدرج (Step)", "نقاط (Scatter)"])
-            
-        item_df = df[df['التصنيف'] == target].copy().sort_values('التاريخ')
-        if not item_df.empty:
-            fig = go.Figure()
-            
-            if chart_type == "خطي انسيابي":
-                fig.add_trace(go.Scatter(x=item_df['التاريخ'], y=item_df['المبلغ'], mode='lines+markers', line=dict(color='#3b82f6', width=5, shape='spline'), marker=dict(size=10, color='white', line=dict(width=2, color='#3b82f6'))))
-            elif chart_type == "أعمدة (Bar)":
-                fig.add_trace(go.Bar(x=item_df['التاريخ'], y=item_df['المبلغ'], marker_color='#3b82f6'))
-            elif chart_type == "مساحي (Area)":
-                fig.add_trace(go.Scatter(x=item_df['التاريخ'], y=item_df['المبلغ'], mode='lines+markers', fill='tozeroy', line=dict(color='#3b82f6', width=3), marker=dict(size=8, color='white', line=dict(width=2, color='#3b82f6'))))
-            elif chart_type == "خطي متدرج (Step)":
-                fig.add_trace(go.Scatter(x=item_df['التاريخ'], y=item_df['المبلغ'], mode='lines+markers', line=dict(color='#3b82f6', width=4, shape='hv'), marker=dict(size=8, color='white', line=dict(width=2, color='#3b82f6'))))
-            elif chart_type == "نقاط (Scatter)":
-                fig.add_trace(go.Scatter(x=item_df['التاريخ'], y=item_df['المبلغ'], mode='markers', marker=dict(size=14, color='#3b82f6', line=dict(width=2, color='white'))))
-            
-            mx = item_df['المبلغ'].max(); mn = item_df['المبلغ'].min()
-            mx_row = item_df[item_df['المبلغ'] == mx].iloc[0]; mn_row = item_df[item_df['المبلغ'] == mn].iloc[0]
-            
-            fig.add_annotation(x=mx_row['التاريخ'], y=mx, text=f"<b>قمة: {mx:,.2f}</b>", showarrow=True, arrowhead=2, arrowsize=1.5, arrowwidth=3, arrowcolor="black", ax=0, ay=-60, font=dict(color="black", size=16, family="Arial Black"), bgcolor="white", bordercolor="black", borderwidth=2)
-            fig.add_annotation(x=mn_row['التاريخ'], y=mn, text=f"<b>قاع: {mn:,.2f}</b>", showarrow=True, arrowhead=2, arrowsize=1.5, arrowwidth=3, arrowcolor="black", ax=0, ay=60, font=dict(color="black", size=16, family="Arial Black"), bgcolor="white", bordercolor="black", borderwidth=2)
-            
-            fig.update_layout(template="plotly_dark", height=500)
-            st.plotly_chart(fig, use_container_width=True)
-        else:
-            st.info(f"لا توجد بيانات مسجلة للبند: {target}")
+@st.fragment
+@profiled("trends_tab", root=True)
+def trends_tab():
+    # سجل كل سنواته مؤرشفة يبقى له ترند وقائمة أشهر تُحمّل عند الاختيار
+    ledger = get_ledger()
+    if ledger.frame.empty and ledger.archive.empty: return
+    trend_panel()
+    st.divider()
+    compare_panel()
 
-        st.divider()
-        st.subheader("📋 جدول المقارنة")
-        pivot = df.pivot_table(index='التصنيف', columns='دورة_الميزانية', values='المبلغ', aggfunc='sum').fillna(0)
-        
-        all_months = sorted(list(pivot.columns), key=lambda x: datetime.strptime(x, "%m-%Y") if x != "None" else datetime.min)
-        avail_items = [c for c in CUSTOM_COMPARE_LIST if c in pivot.index]
-        
-        col_m1, col_m2 = st.columns(2)
-        with col_m1: sel_items = st.multiselect("حدد العناصر:", CUSTOM_COMPARE_LIST, default=avail_items[:10])
-        with col_m2: sel_months = st.multiselect("📅 حدد الأشهر للمقارنة:", all_months, default=all_months)
-        
-        valid_sel = [x for x in sel_items if x in pivot.index]
+@st.fragment
+@profiled("trend_panel", root=True)
+def trend_panel():
+    st.subheader("📈 مسار الترند")
+    
+    col_t1, col_t2, col_t3 = st.columns(3)
+    with col_t1: target = st.selectbox("🔍 اختر البند:", CUSTOM_COMPARE_LIST)
+    with col_t2: chart_type = st.selectbox("📊 شكل الرسم البياني:", ["خطي انسيابي", "أعمدة (Bar)", "مساحي (Area)", "خطي متدرج (Step)", "نقاط (Scatter)"])
+    with col_t3: resolution = st.selectbox("🔎 دقة العرض:", TREND_RESOLUTIONS)
         
-        if valid_sel and sel_months: 
-            display_df = pivot.loc[valid_sel, sel_months]
-            st.dataframe(display_df.style.format("{:,.2f}"), use_container_width=True)
-        elif not sel_months:
-            st.warning("الرجاء تحديد شهر واحد على الأقل للعرض.")
-        elif sel_items:
-            st.warning("العناصر المحددة ليس لها بيانات مسجلة في الجداول حتى الآن.")
+    with timed("trend_figure"): fig = trend_figure(target, resolution, chart_type, get_ledger().version)
+    forecast = None
+    if target in DAILY_CATS:
+        # توقع البند للدورة الحالية (أو آخر دورة مسجلة) من آخر حساب مكتمل في الخلفية
+        cycles = get_ledger().cycles()
+        cyc = get_fiscal_cycle(datetime.now())
+        if cyc not in cycles and cycles: cyc = cycles[0]
+        get_writer().load_cycles([cyc])
+        forecast, _ = cycle_forecast(cyc)
+    anomalies = forecast["anomalies"] if forecast else None
+    if fig is not None and anomalies is not None and resolution == "خام":
+        hits = anomalies[anomalies["التصنيف"] == target]
+        if not hits.empty: fig.add_trace(go.Scatter(x=hits["التاريخ"], y=hits["المبلغ"], mode="markers", name="غير معتادة", marker=dict(color="#ef4444", size=12, symbol="x")))
+    if fig is not None:
+        st.plotly_chart(fig, use_container_width=True)
+    else:
+        st.info(f"لا توجد بيانات مسجلة للبند: {target}")
+    if forecast is not None and target in forecast["categories"].index:
+        row = forecast["categories"].loc[target]
+        avg = row["متوسط الدورات السابقة"]
+        st.caption(f"🔮 دورة {forecast['cycle']}: صُرف {row['المصروف حتى الآن']:,.0f} والمتوقع نهاية الدورة {row['المتوقع نهاية الدورة']:,.0f}" + (f" (متوسط الدورات السابقة {avg:,.0f})" if pd.notna(avg) else ""))
+
+@st.fragment
+@profiled("compare_panel", root=True)
+def compare_panel():
+    st.subheader("📋 جدول المقارنة")
+    ledger = get_ledger()
+    pivot = rollup_pivot(ledger.rollup())
+    
+    # الأشهر المؤرشفة تظهر في القائمة، ولا تُحمّل صفوفها إلا عند اختيارها؛ الاختيار الافتراضي أشهر السنوات الحديثة
+    # لا ما حُمّل حتى الآن، فلا يتغير (ولا يُمسح اختيار المستخدم) حين تُحمّل سنة مؤرشفة
+    all_months = sorted(ledger.cycles(), key=cycle_key)
+    avail_items = [c for c in CUSTOM_COMPARE_LIST if c in pivot.index]
+    
+    col_m1, col_m2 = st.columns(2)
+    with col_m1: sel_items = st.multiselect("حدد العناصر:", CUSTOM_COMPARE_LIST, default=avail_items[:10])
+    with col_m2: sel_months = st.multiselect("📅 حدد الأشهر للمقارنة:", all_months, default=hot_cycles(all_months), key="cmp_months")
+    if get_writer().load_cycles(sel_months): pivot = rollup_pivot(ledger.rollup())
+    
+    valid_sel = [x for x in sel_items if x in pivot.index]
+    
+    if valid_sel and sel_months: 
+        display_df = pivot.reindex(index=valid_sel, columns=sel_months, fill_value=0)
+        st.dataframe(display_df.style.format("{:,.2f}"), use_container_width=True)
+    elif not sel_months:
+        st.warning("الرجاء تحديد شهر واحد على الأقل للعرض.")
+    elif sel_items:
+        st.warning("العناصر المحددة ليس لها بيانات مسجلة في الجداول حتى الآن.")
 
 # --- Tab 5: النسخ الاحتياطي ---
-with tabs[4]:
+@profiled("ledger_csv_bytes", root=True)
+def ledger_csv_bytes(ledger): return full_ledger(ledger).to_csv(index=False).encode('utf-8-sig')
+
+@st.fragment
+@profiled("backup_tab", root=True)
+def backup_tab():
     st.subheader("⚙️ النسخ الاحتياطي والاستعادة")
     st.markdown("""<div style='background:rgba(255, 193, 7, 0.1); padding:15px; border-radius:10px; border:1px solid #ffc107; margin-bottom:20px;'>
     ⚠️ <b>هام جداً:</b> لحفظ بياناتك من الضياع، قم بتحميل ملفات النسخ الاحتياطي (CSV و JSON) بشكل دوري.</div>""", unsafe_allow_html=True)
     
     col_d1, col_d2 = st.columns(2)
-    
-    with col_d1:
-        st.markdown("### 1️⃣ بيانات الأموال")
-        if not df.empty:
-            csv = df.to_csv(index=False).encode('utf-8-sig')
-            st.download_button("📥 تحميل سجل الأموال (CSV)", data=csv, file_name=f"finance_data_{date.today()}.csv", mime="text/csv")
-        
-        up_file = st.file_uploader("استعادة نسخة الأموال (CSV)", type=['csv', 'xlsx'], key="up_csv")
-        if up_file:
-            try:
-                n_df = pd.read_csv(up_file) if up_file.name.endswith('.csv') else pd.read_excel(up_file)
-                n_df['التاريخ'] = pd.to_datetime(n_df['التاريخ'], errors='coerce')
-                st.session_state.df = n_df
-                save_data(n_df)
-                st.success("تم استعادة الأموال!")
-                st.rerun()
-            except: st.error("خطأ في الملف")
-
-    with col_d2:
-        st.markdown("### 2️⃣ الملحوظات والأهداف (الزيت، الغاز...)")
-        json_str = json.dumps(st.session_state.app_config, indent=4, ensure_ascii=False)
-        st.download_button("📥 تحميل الملحوظات (JSON)", data=json_str, file_name=f"notes_goals_{date.today()}.json", mime="application/json")
-        
-        up_json = st.file_uploader("استعادة نسخة الملحوظات (JSON)", type=['json'], key="up_json")
-        if up_json:
-            try:
-                loaded_config = json.load(up_json)
-                st.session_state.app_config = loaded_config
-                save_config(loaded_config)
-                st.success("تم استعادة (الهدف، الزيت، الغاز، الماء)!")
-                st.rerun()
-            except Exception as e: st.error(f"خطأ: {e}")
+    with col_d1: ledger_backup_panel()
+    with col_d2: config_backup_panel()
 
     st.divider()
+    editor_panel()
+
+@st.fragment
+@profiled("ledger_backup_panel", root=True)
+def ledger_backup_panel():
+    st.markdown("### 1️⃣ بيانات الأموال")
+    ledger = get_ledger()
+    if get_writer().mirror_error: st.warning(f"⚠️ تعذر تحديث نسخة CSV من السجل (البيانات محفوظة في قاعدة البيانات، وتُعاد المحاولة مع الحفظ التالي): {get_writer().mirror_error}")
+    if not (ledger.frame.empty and ledger.archive.empty):
+        # الملف يُولَّد عند الضغط على زر التحميل فقط، لا في كل إعادة تشغيل، ويشمل السنوات المؤرشفة
+        st.download_button("📥 تحميل سجل الأموال (CSV)", data=functools.partial(ledger_csv_bytes, ledger), file_name=f"finance_data_{date.today()}.csv", mime="text/csv", on_click="ignore")
+    
+    up_file = st.file_uploader("استعادة نسخة الأموال (CSV)", type=['csv', 'xlsx'], key="up_csv")
+    imp_mode = st.radio("طريقة الاستعادة", list(IMPORT_MODES), horizontal=True, key="imp_mode")
+    if up_file and st.button("📤 استيراد الملف"):
+        bar = st.progress(0.0, text="جارٍ الاستيراد...")
+        try:
+            st.session_state.import_summary = import_ledger(get_writer(), up_file, IMPORT_MODES[imp_mode], lambda f, s: bar.progress(f, text=f"تمت قراءة {s['read']:,} صف"))
+        except Exception as e: st.error(f"خطأ في الملف: {e}")
+        else: st.rerun()
+    if 'import_summary' in st.session_state:
+        s = st.session_state.pop('import_summary')
+        st.success(f"تم استعادة الأموال! قُرئ {s['read']:,} صف، أُضيف {s['accepted']:,}، وتُجوهل {s['duplicates']:,} مكرر.")
+        if s['rejected']: st.warning("صفوف مرفوضة: " + "، ".join(f"{k}: {v:,}" for k, v in s['rejected'].items()))
+
+@st.fragment
+@profiled("config_backup_panel", root=True)
+def config_backup_panel():
+    st.markdown("### 2️⃣ الملحوظات والأهداف (الزيت، الغاز...)")
+    st.download_button("📥 تحميل الملحوظات (JSON)", data=functools.partial(json.dumps, app_config(), indent=4, ensure_ascii=False), file_name=f"notes_goals_{date.today()}.json", mime="application/json", on_click="ignore")
+    
+    up_json = st.file_uploader("استعادة نسخة الملحوظات (JSON)", type=['json'], key="up_json")
+    # الاستعادة بزر مثل ملف الأموال: الملف يبقى في الخانة بعد إعادة التشغيل فلا يُحفظ مع كل تشغيل
+    if up_json and st.button("📤 استعادة الملحوظات"):
+        try:
+            loaded_config = json.load(up_json)
+            get_writer().update_config(loaded_config, replace=True)
+        except Exception as e: st.error(f"خطأ: {e}")
+        else:
+            st.session_state.config_restored = True
+            st.rerun()
+    if st.session_state.pop('config_restored', False): st.success("تم استعادة (الهدف، الزيت، الغاز، الماء)!")
+
+@st.fragment
+@profiled("editor_panel", root=True)
+def editor_panel():
+    ledger = get_ledger()
     st.write("### ✏️ تعديل الجدول يدوياً")
-    ed = st.data_editor(st.session_state.df, num_rows="dynamic", use_container_width=True)
-    if st.button("💾 حفظ تعديلات الجدول"): st.session_state.df = ed; save_data(ed); st.success("تم!"); st.rerun()
+    f1, f2, f3, f4 = st.columns(4)
+    with f1: e_cycle = st.selectbox("الدورة", ["الكل"] + ledger.cycles(), key="ed_cycle")
+    if e_cycle != "الكل": get_writer().load_cycles([e_cycle])
+    df = ledger.frame
+    with f2: e_cat = st.selectbox("التصنيف", ["الكل"] + sorted(df['التصنيف'].cat.categories), key="ed_cat")
+    with f3: e_range = st.date_input("الفترة", value=(), key="ed_range")
+    e_ids = ledger_filter(df, cycle=None if e_cycle == "الكل" else e_cycle, category=None if e_cat == "الكل" else e_cat,
+                          start=e_range[0] if len(e_range) == 2 else None, end=e_range[1] if len(e_range) == 2 else None)
+    with f4: e_page = st.number_input("الصفحة", min_value=1, max_value=page_count(e_ids), value=1, step=1, key="ed_page")
+    page = ledger_page(df, e_ids, e_page - 1)
+    # المفتاح ثابت للفلاتر والصفحة، و ed_gen يتغير بعد الحفظ أو التجاهل فقط. إن تغيّر السجل من جلسة أخرى أثناء التعديل
+    # تبقى الصفحة التي بدأ عليها التعديل معروضة (بيانات جديدة تعيد تهيئة المحرر وتمسح التعديلات) مع تنبيه حتى الحفظ أو إعادة التحميل
+    ed_key = f"ledger_editor_{st.session_state.get('ed_gen', 0)}_{e_cycle}_{e_cat}_{e_range}_{e_page}"
+    ed_state = st.session_state.get(ed_key) or {}
+    snap = st.session_state.get('ed_snapshot')
+    if snap and snap[0] == ed_key and snap[1] != ledger.version and any(ed_state.get(k) for k in ("edited_rows", "added_rows", "deleted_rows")):
+        page = snap[2]
+        st.warning("⚠️ تغيّر السجل من جلسة أخرى أثناء التعديل. احفظ تعديلاتك، أو أعد التحميل لعرض البيانات الجديدة (تُفقد التعديلات غير المحفوظة).")
+        if st.button("🔄 إعادة التحميل"):
+            st.session_state.ed_gen = st.session_state.get('ed_gen', 0) + 1; st.rerun(scope="fragment")
+    else: st.session_state.ed_snapshot = (ed_key, ledger.version, page)
+    with timed("editor.payload") as rec:
+        rec["bytes"] = int(page.memory_usage(deep=True).sum())
+        st.data_editor(page, num_rows="dynamic", use_container_width=True, disabled=['دورة_الميزانية'], key=ed_key)
+    st.caption(f"الصفحة {e_page} من {page_count(e_ids)} — {len(e_ids)} عملية")
+    if st.button("💾 حفظ تعديلات الجدول"):
+        added, changed, deleted = editor_changes(page, st.session_state[ed_key])
+        if added.empty and changed.empty and not deleted: st.info("لا توجد تعديلات للحفظ")
+        else:
+            get_writer().save_changes(added, changed, deleted)
+            st.session_state.ed_gen = st.session_state.get('ed_gen', 0) + 1
+            st.success(f"تم! ({len(added)} مضافة، {len(changed)} معدلة، {len(deleted)} محذوفة)"); st.rerun()
+    compact_b, legacy_b = ledger.memory_report()
+    st.caption(f"💾 ذاكرة السجل المشترك: {compact_b / 1024:,.0f} KB بدلاً من {legacy_b / 1024:,.0f} KB (توفير {(legacy_b - compact_b) / 1024:,.0f} KB)")
+    if not ledger.archive.empty:
+        st.caption(f"📦 سنوات مؤرشفة لم تُحمّل بعد: {'، '.join(map(str, sorted(ledger.archived_years())))} ({int(ledger.archive['rows'].sum()):,} عملية) — تُحمّل عند اختيار إحدى دوراتها")
 
 # --- إدخال الدخل والثابت ---
-with tabs[2]:
+@profiled("income_fixed_tab")
+def income_fixed_tab():
+    writer = get_writer()
     c1, c2 = st.columns(2)
     with c1:
         with st.form("i", clear_on_submit=True):
             st.subheader("💰 دخل"); d=st.date_input("تاريخ"); c=st.selectbox("مصدر", INCOME_CATS); a=st.number_input("مبلغ")
-            if st.form_submit_button("حفظ"): st.session_state.df = pd.concat([st.session_state.df, pd.DataFrame([{"التاريخ":pd.to_datetime(d),"اليوم":d_name,"النوع":"دخل","التصنيف":c,"المبلغ":a}])], ignore_index=True); save_data(st.session_state.df); st.rerun()
+            if st.form_submit_button("حفظ"):
+                row = {"التاريخ":pd.to_datetime(d),"اليوم":d_name,"النوع":"دخل","التصنيف":c,"المبلغ":a}
+                writer.append([row]); st.rerun()
     with c2:
         with st.form("f", clear_on_submit=True):
             st.subheader("🏠 ثابت"); d=st.date_input("تاريخ"); c=st.selectbox("نوع", FIXED_CATS); a=st.number_input("مبلغ")
-            if st.form_submit_button("حفظ"): st.session_state.df = pd.concat([st.session_state.df, pd.DataFrame([{"التاريخ":pd.to_datetime(d),"اليوم":d_name,"النوع":"مصروفات ثابتة","التصنيف":c,"المبلغ":a}])], ignore_index=True); save_data(st.session_state.df); st.rerun()
\ No newline at end of file
+            if st.form_submit_button("حفظ"):
+                row = {"التاريخ":pd.to_datetime(d),"اليوم":d_name,"النوع":"مصروفات ثابتة","التصنيف":c,"المبلغ":a}
+                writer.append([row]); st.rerun()
+
+# --- لوحة قياس الأداء (مخفية): تظهر بإضافة ?profile=1 إلى رابط الصفحة ---
+@st.fragment
+def profile_panel():
+    st.divider()
+    st.write("### ⏱️ قياس الأداء")
+    runs = profile_runs()
+    if not runs: return
+    labels = sorted({r["label"] for r in runs})
+    c1, c2 = st.columns(2)
+    with c1: label = st.selectbox("التشغيل", labels, index=labels.index("app") if "app" in labels else 0, key="prof_label")
+    with c2: window = st.slider("نافذة المئينات (آخر تشغيلات)", 10, 500, 100, step=10, key="prof_window")
+    runs = profile_runs(label, window)
+    last = runs[-1]
+    st.caption(f"آخر تشغيل {last['at']} — {last['total_ms']:,.1f}ms ({last['status']}) — ذاكرة العملية {last['rss'] / 2**20:,.0f} MB" + (f" — {last['rows']:,} صف" if 'rows' in last else ""))
+    stages = last["stages"]
+    if stages:
+        # شلال التشغيل الأخير: كل مقطع يبدأ عند لحظة بدايته، والمقاطع المتداخلة مزاحة حسب عمقها
+        names = [f"{i + 1}. {'  ' * s['depth']}{s['name']}" for i, s in enumerate(stages)]
+        fig = go.Figure(go.Bar(y=names, x=[s["ms"] for s in stages], base=[s["start"] for s in stages], orientation="h",
+                               text=[f"{s['ms']:,.1f}ms" for s in stages], marker_color=[s["depth"] for s in stages]))
+        fig.update_layout(template="plotly_dark", yaxis=dict(autorange="reversed"), xaxis_title="ms", height=120 + 26 * len(stages), margin=dict(l=10, r=10, t=10, b=10))
+        st.plotly_chart(fig, use_container_width=True)
+        mem = pd.DataFrame([{"المقطع": n, "تغير الذاكرة KB": s["rss_delta"] / 1024, "الحمولة KB": s.get("bytes", 0) / 1024} for n, s in zip(names, stages)])
+        st.dataframe(mem[(mem["تغير الذاكرة KB"] != 0) | (mem["الحمولة KB"] > 0)].round(1), use_container_width=True, hide_index=True)
+    st.write(f"#### المئينات (ms) لآخر {len(runs)} تشغيل")
+    st.dataframe(profile_summary(runs), use_container_width=True)
+    st.caption(f"سجل JSONL: {PROFILE_LOG}" if PROFILE_LOG else "سجل JSONL معطل؛ فعّله بمتغير البيئة FINANCE_PROFILE_LOG=<مسار الملف>")
+
+# كل رسم كامل يعرض أحدث نسخة، فتُسجل هنا ويقارن بها live_sync دورياً
+get_writer().sync()
+st.session_state.seen_version = get_writer().version
+live_sync()
+
+tabs = st.tabs(["📊 الرئيسية", "🛒 إضافة مصروفات (شامل)", "💰 دخل وثوابت", "🔄 مقارنات وترند", "⚙️ النسخ الاحتياطي"], key="main_tabs", on_change="rerun")
+for tab, render in zip(tabs, [home_tab, bulk_tab, income_fixed_tab, trends_tab, backup_tab]):
+    if tab.open:
+        with tab: render()
+
+run = st.session_state.pop('profile_run')
+run.meta["rows"] = len(get_ledger().frame)
+end_run(run)
+
+if st.query_params.get("profile") == "1": profile_panel()
@@ -0,0 +1,131 @@
+"""قياس أداء finance_engine على سجلات مولّدة بنفس أعمدة finance_master_2026.csv ومقارنتها بخط أساس محفوظ.
+
+    python bench.py                       # الأحجام الافتراضية ومقارنة مع bench_baseline.json
+    python bench.py --sizes 1000 10000000 # حتى 10 ملايين صف
+    python bench.py --save-baseline       # حفظ النتائج الحالية كخط أساس جديد
+
+يخرج بالرمز 1 إن تباطأت أي حالة أكثر من --tolerance مقارنة بخط الأساس.
+"""
+import argparse, json, os, sys, tempfile, threading, time
+
+import numpy as np
+import pandas as pd
+
+import finance_engine as fe
+
+BASELINE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+DEFAULT_SIZES = [1_000, 10_000, 100_000]
+NOISE_FLOOR = 0.005  # فروق أقل من 5 ملي ثانية لا تُعد تراجعاً
+WRITER_SESSIONS, WRITER_ROWS = 8, 10  # جلسات متزامنة، وصفوف يضيفها كل منها صفاً صفاً
+DAY_NAMES = ["الإثنين", "الثلاثاء", "الأربعاء", "الخميس", "الجمعة", "السبت", "الأحد"]
+
+def make_ledger(n, seed=0):
+    # سجل واقعي: مصروفات يومية غالباً، ودخل وثوابت قليلة، على مدى يتناسب مع عدد الصفوف (نحو 20 عملية يومياً)
+    rng = np.random.default_rng(seed)
+    days = max(60, n // 20)
+    dates = np.datetime64('2026-01-01') - rng.integers(0, days, n).astype('timedelta64[D]')
+    kind = rng.choice(3, n, p=[0.05, 0.05, 0.90])
+    cats = [fe.INCOME_CATS, fe.FIXED_CATS, fe.DAILY_CATS]
+    category = np.empty(n, dtype=object)
+    for k, names in enumerate(cats):
+        sel = kind == k
+        category[sel] = np.asarray(names, dtype=object)[rng.integers(0, len(names), sel.sum())]
+    amount = np.where(kind == 0, rng.lognormal(7.5, 1.0, n), np.where(kind == 1, rng.lognormal(7.0, 0.5, n), rng.gamma(2.0, 40.0, n))).round(2)
+    weekday = (dates.astype(np.int64) + 3) % 7  # 1970-01-01 كان خميس
+    df = pd.DataFrame({
+        'التاريخ': pd.to_datetime(dates),
+        'اليوم': np.asarray(DAY_NAMES, dtype=object)[weekday],
+        'النوع': np.asarray(['دخل', 'مصروفات ثابتة', 'مصروف'], dtype=object)[kind],
+        'التصنيف': category,
+        'المبلغ': amount,
+        'التفاصيل': np.where(rng.random(n) < 0.3, "إدخال متعدد", None),
+    })
+    return df.sort_values('التاريخ', kind='stable').reset_index(drop=True)
+
+def _best(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        t = time.perf_counter(); fn(); times.append(time.perf_counter() - t)
+    return min(times)
+
+def run_size(n, repeat, backend):
+    # يعيد {حالة: أفضل زمن بالثواني} لحجم واحد
+    df = make_ledger(n)
+    out = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        fe.DB_FILE, fe.JOURNAL_FILE, fe.SQLITE_FILE = (os.path.join(tmp, f) for f in ("ledger.csv", "journal.jsonl", "ledger.db"))
+        fe.CONFIG_FILE, fe.LOCK_FILE, fe.STAMP_FILE = (os.path.join(tmp, f) for f in ("config.json", "ledger.lock", "ledger.stamp"))
+        fe.STORAGE_BACKEND, fe.CSV_MIRROR = backend, False
+        out["save"] = _best(lambda: fe.save_data(df), repeat)
+        out["load"] = _best(fe.load_data, repeat)
+        out["cycles"] = _best(lambda: fe.get_fiscal_cycles(df['التاريخ']), repeat)
+        out["compact"] = _best(lambda: fe.compact_ledger(df), repeat)
+        out["rollup"] = _best(lambda: fe.build_rollup(df), repeat)
+        roll = fe.build_rollup(df)
+        recent = fe.rollup_cycles(roll)[:12]
+        def dashboards():
+            # ما يحسبه تبويب الرئيسية لكل دورة: البطاقات، الصرف اليومي، توزيع التصنيفات، حدود الدورة
+            fe.rollup_totals(roll)
+            for c in recent:
+                fe.rollup_totals(roll, c); fe.rollup_daily_spend(roll, c); fe.rollup_by_category(roll, c, income=False); fe.get_cycle_range(c)
+        out["dashboards"] = _best(dashboards, repeat)
+        out["pivot"] = _best(lambda: fe.rollup_pivot(roll), repeat)
+        def open_writer():
+            # بدء عملية الخادم: في مخزن sqlite تُحمّل السنوات الحديثة فقط وتُقرأ ملخصات الباقي
+            fe.LedgerWriter().close()
+        out["open"] = _best(open_writer, repeat)
+        writer = fe.LedgerWriter()
+        rows = df.head(WRITER_ROWS).to_dict('records')
+        def concurrent_append():
+            # جلسات متزامنة تضيف عبر الكاتب الواحد؛ الدفعات تُجمع فلا يزيد الزمن خطياً مع عدد الجلسات
+            ts = [threading.Thread(target=lambda: [writer.append([r]) for r in rows]) for _ in range(WRITER_SESSIONS)]
+            for t in ts: t.start()
+            for t in ts: t.join()
+        out["concurrent_append"] = _best(concurrent_append, repeat)
+        writer.close()
+    return out
+
+def compare(results, baseline, tolerance):
+    # قائمة (حجم، حالة، الحالي، الأساس) لكل حالة تجاوزت حد التباطؤ
+    slow = []
+    for size, cases in results.items():
+        for case, t in cases.items():
+            base = baseline.get(size, {}).get(case)
+            if base is not None and t > base * tolerance and t - base > NOISE_FLOOR: slow.append((size, case, t, base))
+    return slow
+
+def main(argv=None):
+    p = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    p.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="أعداد الصفوف (من 1000 حتى 10000000)")
+    p.add_argument("--repeat", type=int, default=3, help="عدد التكرارات، ويُؤخذ أفضل زمن")
+    p.add_argument("--backend", choices=["csv", "sqlite"], default="csv")
+    p.add_argument("--baseline", default=BASELINE_FILE)
+    p.add_argument("--tolerance", type=float, default=1.5, help="أقصى نسبة مسموحة للزمن الحالي إلى زمن الأساس")
+    p.add_argument("--save-baseline", action="store_true")
+    args = p.parse_args(argv)
+
+    results = {}
+    for n in args.sizes:
+        results[str(n)] = run_size(n, args.repeat, args.backend)
+        print(f"{n:>10,} صف  " + "  ".join(f"{k}={v * 1000:,.1f}ms" for k, v in results[str(n)].items()), flush=True)
+
+    stored = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f: stored = json.load(f)
+    if args.save_baseline:
+        stored[args.backend] = {**stored.get(args.backend, {}), **results}
+        with open(args.baseline, 'w', encoding='utf-8') as f: json.dump(stored, f, indent=2, sort_keys=True)
+        print(f"حُفظ خط الأساس في {args.baseline}")
+        return 0
+    baseline = stored.get(args.backend, {})
+    if not baseline:
+        print("لا يوجد خط أساس للمقارنة (استخدم --save-baseline)")
+        return 0
+    slow = compare(results, baseline, args.tolerance)
+    for size, case, t, base in slow:
+        print(f"تراجع: {case} عند {int(size):,} صف: {t * 1000:,.1f}ms مقابل {base * 1000:,.1f}ms")
+    print("لا تراجع في الأداء" if not slow else f"{len(slow)} حالة أبطأ من خط الأساس")
+    return 1 if slow else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
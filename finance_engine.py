@@ -0,0 +1,1198 @@
+"""محرك المستشار المالي: دورات الراتب، التخزين، التجميعات والاستيراد، بلا أي اعتماد على واجهة ستريمليت.
+
+app.py يبني الواجهة فوق هذه الدوال، و bench.py يقيس أداءها على سجلات مولّدة.
+إعدادات التخزين (مسارات الملفات، STORAGE_BACKEND، CSV_MIRROR) متغيرات على مستوى الوحدة تُقرأ وقت الاستدعاء.
+الواجهة تكتب عبر LedgerWriter فقط؛ دوال الحفظ المباشرة (append_rows، save_data، save_changes) للاستخدام بلا واجهة.
+"""
+import os, json, sqlite3, threading, queue, time, multiprocessing
+from collections import deque, OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, BrokenExecutor
+from contextlib import closing, contextmanager
+from functools import wraps
+from itertools import groupby
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+try: import fcntl
+except ImportError: fcntl = None  # ويندوز: يبقى التسلسل داخل العملية الواحدة فقط
+
+__all__ = [
+    "DB_FILE", "JOURNAL_FILE", "SQLITE_FILE", "STORAGE_BACKEND", "CSV_MIRROR",
+    "DAILY_CATS", "INCOME_CATS", "FIXED_CATS", "CUSTOM_COMPARE_LIST", "LEDGER_COLS", "INCOME_TYPES",
+    "get_salary_day", "cycle_key", "cycle_label", "get_fiscal_cycles", "get_cycle_ranges", "get_fiscal_cycle", "get_cycle_range",
+    "load_data", "append_rows", "save_data", "save_changes", "query_ledger", "compact_journal",
+    "build_rollup", "rollup_merge", "rollup_totals", "rollup_cycles", "rollup_daily_spend", "rollup_by_category", "rollup_pivot",
+    "ledger_amounts", "compact_ledger", "expand_ledger", "SharedLedger",
+    "PAGE_SIZE", "ledger_filter", "ledger_page", "page_count", "editor_changes",
+    "CONFIG_FILE", "LOCK_FILE", "STAMP_FILE", "load_config", "LedgerWriter",
+    "HOT_YEARS", "cycle_year", "cycle_summaries", "full_ledger",
+    "content_hashes", "validate_batch", "import_ledger",
+    "TREND_RESOLUTIONS", "TREND_MAX_POINTS", "trend_series", "lttb",
+    "ANALYTICS_HISTORY", "analytics_inputs", "cycle_analytics", "CycleAnalytics",
+    "PROFILE_LOG", "begin_run", "end_run", "timed", "profiled", "profile_runs", "profile_summary",
+]
+
+DB_FILE = "finance_master_2026.csv"
+JOURNAL_FILE = "finance_journal_2026.jsonl"
+JOURNAL_MAX_BYTES = 256 * 1024
+SQLITE_FILE = "finance_master_2026.db"
+STORAGE_BACKEND = "sqlite"  # "sqlite" (مفهرس) أو "csv"
+CSV_MIRROR = False  # وضع التوافق: يبقى ملف CSV محدّثاً مع كل كتابة في sqlite. معطل افتراضياً: كل حفظ من المحرر يعيد كتابة
+# الملف كاملاً (ويقرأ السنوات المؤرشفة من sqlite)، فيصير التعديل بحجم السجل لا بحجم الفرق؛ النسخة تُنزّل من تبويب النسخ الاحتياطي
+
+DAILY_CATS = ["بنزين", "ماء", "الزيت", "الغاز", "السيارة", "تصليح", "فواتير", "مقاضي البيت", "مقاهي", "خضاروفواكهه", "مخالفات", "مقاضي البنات", "المستشفيات والصيدليات", "مطاعم", "ترفيه وحجوزات", "خدمات خارجية", "قطات", "عناية", "أخرى"]
+INCOME_CATS = ["الراتب", "حساب المواطن", "الدعم السكني", "الاسهم", "مسترجعات", "حقوق خاصة", "العمالة", "انتداب", "اركابات", "أخرى"]
+FIXED_CATS = ["القرض الشخصي", "القرض", "القرض العقاري", "امي", "كفالة", "الاعاشة"]
+
+CUSTOM_COMPARE_LIST = ["أمي", "الاعاشة", "اركابات", "الاسهم", "الدعم السكني", "الراتب", "السيارة", "العمالة", "القرض الشخصي", "القرض العقاري", "المستشفيات والصيدليات", "بنزين", "ترفيه وحجوزات", "تصليح", "انتداب", "حساب المواطن", "خدمات خارجية", "خضار وفواكه", "ديون", "زكاة", "عناية", "فواتير", "قطات", "كفالة", "مخالفات", "مسترجعات", "مطاعم", "مقاضي البيت", "مقاضي البنات", "مقاهي وكفيهات"]
+
+# --- قياس الأداء: مؤقتات مسماة لكل تشغيل (إعادة تشغيل الصفحة أو جزء منها أو دفعة كتابة) ---
+# timed/profiled لا تسجل شيئاً (ولا تقرأ الذاكرة) إلا داخل تشغيل بدأه begin_run، أو حين تُعلَّم root=True
+# فتصبح هي جذر تشغيل مستقل (مثل إعادة تشغيل fragment وحده أو دفعة كتابة)؛ الاستخدام بلا واجهة (bench.py) لا يُقاس
+PROFILE_LOG = os.environ.get("FINANCE_PROFILE_LOG")  # مسار ملف JSONL اختياري يُلحق به كل تشغيل
+PROFILE_RUNS = deque(maxlen=500)  # آخر التشغيلات في هذه العملية، تتشاركها كل الجلسات
+_profile_lock = threading.Lock()
+_active = threading.local()
+
+def _rss_bytes():
+    # ذاكرة العملية الحالية؛ من /proc على لينكس وإلا أقصى قيمة من resource
+    try:
+        with open("/proc/self/statm") as f: return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except ImportError: return 0
+
+class RunProfile:
+    def __init__(self, label):
+        self.label, self.at, self.t0 = label, datetime.now(), time.perf_counter()
+        self.stages, self.depth, self.meta = [], 0, {}
+
+def begin_run(label):
+    run = RunProfile(label)
+    _active.run = run
+    return run
+
+def end_run(run, status="ok"):
+    if getattr(_active, "run", None) is run: _active.run = None
+    record = {"label": run.label, "at": run.at.isoformat(timespec="milliseconds"), "status": status,
+              "total_ms": round((time.perf_counter() - run.t0) * 1000, 3), "rss": _rss_bytes(), **run.meta,
+              "stages": sorted(run.stages, key=lambda r: r["start"])}
+    with _profile_lock:
+        PROFILE_RUNS.append(record)
+        if PROFILE_LOG:
+            try:
+                with open(PROFILE_LOG, 'a', encoding='utf-8') as f: f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            except OSError: pass
+    return record
+
+@contextmanager
+def timed(name, root=False):
+    # يعيد قاموس المقطع، ويمكن للمستدعي إضافة عدادات إليه (مثل "bytes" لحجم ما أُرسل للمتصفح)
+    run = getattr(_active, "run", None)
+    if run is None and not root:
+        yield {}
+        return
+    root = run is None
+    if root: run = begin_run(name)
+    rec = {"name": name, "depth": run.depth, "start": round((time.perf_counter() - run.t0) * 1000, 3)}
+    rss, t, status = _rss_bytes(), time.perf_counter(), "ok"
+    run.depth += 1
+    try: yield rec
+    except BaseException:
+        # إيقاف ستريمليت (st.rerun/st.stop) يمر هنا أيضاً كاستثناء
+        status = "interrupted"; raise
+    finally:
+        run.depth -= 1
+        rec["ms"] = round((time.perf_counter() - t) * 1000, 3)
+        rec["rss_delta"] = _rss_bytes() - rss
+        run.stages.append(rec)
+        if root: end_run(run, status)
+
+def profiled(name, root=False):
+    def deco(fn):
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(name, root): return fn(*args, **kwargs)
+        return wrapper
+    return deco
+
+def profile_runs(label=None, last=None):
+    with _profile_lock: runs = list(PROFILE_RUNS)
+    if label is not None: runs = [r for r in runs if r["label"] == label]
+    return runs[-last:] if last else runs
+
+def profile_summary(runs):
+    # زمن كل مقطع عبر التشغيلات: العدد والمتوسط والمئينات، مرتبة بالأثقل أولاً
+    rows = [{"المقطع": s["name"], "ms": s["ms"]} for r in runs for s in r["stages"]]
+    rows += [{"المقطع": "(الإجمالي)", "ms": r["total_ms"]} for r in runs]
+    if not rows: return pd.DataFrame(columns=["العدد", "المتوسط", "p50", "p90", "p99"])
+    g = pd.DataFrame(rows).groupby("المقطع")["ms"]
+    out = pd.DataFrame({"العدد": g.size(), "المتوسط": g.mean(), "p50": g.quantile(0.5), "p90": g.quantile(0.9), "p99": g.quantile(0.99)})
+    return out.sort_values("p90", ascending=False).round(2)
+
+# --- دورات الراتب ---
+# جدول أيام الراتب محسوب مسبقاً لكل (سنة، شهر) ومفهرس برقم الشهر المطلق (سنة*12 + شهر-1)
+_SALARY_TABLE = {"base": 0, "days": np.empty(0, dtype=np.int8)}
+
+def _build_salary_table(y0, y1):
+    months = np.arange((y0 - 1970) * 12, (y1 - 1970 + 1) * 12).astype('datetime64[M]')
+    wd = (months.astype('datetime64[D]').astype(np.int64) + 26 + 3) % 7  # 1970-01-01 كان خميس
+    _SALARY_TABLE["base"] = y0 * 12
+    _SALARY_TABLE["days"] = np.where(wd == 4, 26, np.where(wd == 5, 28, 27)).astype(np.int8)
+
+def _salary_days(ym):
+    ym = np.asarray(ym, dtype=np.int64)
+    if ym.size == 0: return np.empty(0, dtype=np.int8)
+    base, days = _SALARY_TABLE["base"], _SALARY_TABLE["days"]
+    if ym.min() < base or ym.max() >= base + len(days):
+        _build_salary_table(min(2000, int(ym.min()) // 12), max(2100, int(ym.max()) // 12))
+        base, days = _SALARY_TABLE["base"], _SALARY_TABLE["days"]
+    return days[ym - base]
+
+_build_salary_table(2000, 2100)
+
+def get_salary_day(year, month):
+    try:
+        if not 1 <= int(month) <= 12: return 27
+        return int(_salary_days([int(year) * 12 + int(month) - 1])[0])
+    except: return 27
+
+def cycle_key(cycle_str):
+    # مفتاح ترتيب رقمي للدورة "mm-YYYY"، و -1 لـ "None" أو أي قيمة غير صالحة
+    try:
+        month, year = map(int, str(cycle_str).split('-'))
+        return year * 12 + month - 1 if 1 <= month <= 12 else -1
+    except: return -1
+
+def cycle_label(key): return f"{key % 12 + 1:02d}-{key // 12}"
+
+@profiled("get_fiscal_cycles")
+def get_fiscal_cycles(dates):
+    # نسخة متجهة من get_fiscal_cycle لعمود كامل دفعة واحدة
+    dates = pd.to_datetime(pd.Series(dates), errors='coerce')
+    out = pd.Series("None", index=dates.index, dtype=object)
+    valid = dates.notna().to_numpy()
+    if valid.any():
+        d = dates[valid]
+        ym = d.dt.year.to_numpy(dtype=np.int64) * 12 + d.dt.month.to_numpy(dtype=np.int64) - 1
+        keys = ym + (d.dt.day.to_numpy() >= _salary_days(ym))
+        uniq, inv = np.unique(keys, return_inverse=True)
+        out[valid] = np.array([cycle_label(int(k)) for k in uniq], dtype=object)[inv]
+    return out
+
+# مدى الدورات التي تقع حدودها داخل نطاق date في بايثون (البداية في الشهر السابق): 02-0001 حتى 12-9999
+_CYCLE_KEYS = (12 + 1, 9999 * 12 + 11)
+
+def get_cycle_ranges(cycles):
+    # حدود الدورات (بداية، نهاية) لعمود كامل من تسميات الدورات، و NaT للقيم غير الصالحة أو خارج المدى
+    cycles = pd.Series(cycles)
+    keys = cycles.map(cycle_key).to_numpy(dtype=np.int64)
+    start = np.full(len(keys), np.datetime64('NaT'), dtype='datetime64[D]')
+    end = start.copy()
+    ok = (keys >= _CYCLE_KEYS[0]) & (keys <= _CYCLE_KEYS[1])
+    if ok.any():
+        k = keys[ok]
+        months = (k - 1970 * 12).astype('datetime64[M]')
+        start[ok] = (months - 1).astype('datetime64[D]') + (_salary_days(k - 1).astype(np.int64) - 1)
+        end[ok] = months.astype('datetime64[D]') + (_salary_days(k).astype(np.int64) - 2)
+    return pd.DataFrame({"start": start, "end": end}, index=cycles.index)
+
+def get_fiscal_cycle(dt):
+    if pd.isna(dt): return "None"
+    return get_fiscal_cycles([dt]).iloc[0]
+
+def get_cycle_range(cycle_str):
+    r = get_cycle_ranges([cycle_str]).iloc[0]
+    if pd.isna(r["start"]): return None, None
+    return r["start"].date(), r["end"].date()
+
+LEDGER_COLS = ['التاريخ', 'اليوم', 'النوع', 'التصنيف', 'المبلغ', 'التفاصيل']
+
+def _coerce_ledger(df):
+    df['التاريخ'] = pd.to_datetime(df['التاريخ'], errors='coerce')
+    df['المبلغ'] = pd.to_numeric(df['المبلغ'], errors='coerce').fillna(0)
+    return df.dropna(subset=['التاريخ'])
+
+# --- سجل الإضافات (journal): الصفوف الجديدة تُلحق بملف صغير بدل إعادة كتابة الملف الأساسي ---
+# أول سطر في السجل يحمل جيل الملف الأساسي الذي بُني عليه. الجيل ملف صغير بجانب الأساسي لا يتغير إلا حين يكتبه التطبيق،
+# فنسخ الملف أو استعادته أو تغيّر وقت تعديله لا يُسقط السجل
+def _gen_file(): return DB_FILE + ".gen"
+
+def _base_signature():
+    try:
+        with open(_gen_file(), 'r', encoding='utf-8') as f: return f.read().strip() or "none"
+    except OSError: return "none"
+
+def _journal_header():
+    try:
+        with open(JOURNAL_FILE, 'r', encoding='utf-8') as f: return json.loads(f.readline()).get("base")
+    except: return None
+
+def _read_base():
+    return _coerce_ledger(pd.read_csv(DB_FILE)) if os.path.exists(DB_FILE) else pd.DataFrame(columns=LEDGER_COLS)
+
+def _journal_frame(rows):
+    # أسطر السجل الأقدم تاريخ فقط والأحدث بالوقت كاملاً؛ ISO8601 يقرأ الصيغتين في العمود نفسه دون إسقاط أي منهما
+    df = pd.DataFrame(rows).reindex(columns=LEDGER_COLS)
+    df['التاريخ'] = pd.to_datetime(df['التاريخ'], format='ISO8601', errors='coerce')
+    return df
+
+def _read_journal(base=None):
+    if not os.path.exists(JOURNAL_FILE): return []
+    rows = []
+    with open(JOURNAL_FILE, 'r', encoding='utf-8') as f:
+        next(f, None)
+        for line in f:
+            try: rows.append(json.loads(line))
+            except ValueError: pass  # سطر مبتور من كتابة انقطعت
+    if rows and _journal_header() != _base_signature():
+        # سجل من جيل سابق: دمج انقطع قبل حذف السجل، أو سجل أقدم من ملف الجيل. لا يُهمل؛ تُستبعد فقط صفوفه الموجودة فعلاً في الأساسي
+        base = _read_base() if base is None else base
+        uniq, counts = np.unique(content_hashes(base), return_counts=True)
+        keep = _new_rows_mask(content_hashes(_journal_frame(rows)), uniq, counts, {})
+        rows = [r for r, k in zip(rows, keep) if k]
+    return rows
+
+def _write_base(df):
+    # كتابة ذرية: ملف مؤقت ثم استبدال، فلا يُبتر السجل الأساسي لو انقطعت الكتابة.
+    # الجيل الجديد يُكتب قبل الاستبدال، فانقطاع بينهما يترك السجل بجيل قديم فتُقارن صفوفه بالأساسي (انظر _read_journal)
+    tmp = DB_FILE + ".tmp"
+    with open(tmp, 'w', encoding='utf-8-sig', newline='') as f:
+        df.to_csv(f, index=False)
+        f.flush(); os.fsync(f.fileno())
+    _write_atomic(_gen_file(), os.urandom(8).hex())
+    os.replace(tmp, DB_FILE)
+
+def _drop_journal():
+    if os.path.exists(JOURNAL_FILE): os.remove(JOURNAL_FILE)
+
+def _csv_read():
+    base = _read_base()
+    rows = _read_journal(base)
+    return pd.concat([base, _coerce_ledger(_journal_frame(rows))], ignore_index=True) if rows else base
+
+def compact_journal():
+    # دمج السجل في الملف الأساسي ثم حذفه
+    base = _read_base()
+    rows = _read_journal(base)
+    if rows: _write_base(pd.concat([base, _coerce_ledger(_journal_frame(rows))], ignore_index=True))
+    _drop_journal()
+
+def _csv_append(rows):
+    # سجل من جيل سابق يُدمج أولاً (بصفوفه غير الموجودة في الأساسي) ثم يبدأ سجل جديد على الجيل الحالي
+    if os.path.exists(JOURNAL_FILE) and _journal_header() != _base_signature(): compact_journal()
+    new = not os.path.exists(JOURNAL_FILE)
+    torn = False  # آخر سطر مبتور بلا نهاية سطر من كتابة سابقة انقطعت
+    if not new:
+        with open(JOURNAL_FILE, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell(): f.seek(-1, os.SEEK_END); torn = f.read(1) != b"\n"
+    lines = [json.dumps({"base": _base_signature()})] if new else [""] if torn else []
+    for r in rows:
+        # الوقت يُحفظ أيضاً: صفوف كشوف البنك المستوردة تحمل وقت العملية، وبصمة المحتوى تعتمد عليه
+        r = {**r, "التاريخ": pd.Timestamp(r["التاريخ"]).strftime('%Y-%m-%d %H:%M:%S')}
+        lines.append(json.dumps(r, ensure_ascii=False, default=str))
+    data = memoryview("".join(l + "\n" for l in lines).encode('utf-8'))
+    # الدفعة كلها أو لا شيء: عند فشل الكتابة يُقص الملف إلى طوله السابق فلا تبقى صفوف نصف محفوظة
+    with open(JOURNAL_FILE, 'ab', buffering=0) as f:
+        start = f.seek(0, os.SEEK_END)
+        try:
+            while data: data = data[f.write(data):]
+            os.fsync(f.fileno())
+        except BaseException:
+            f.truncate(start); raise
+    if os.path.getsize(JOURNAL_FILE) > JOURNAL_MAX_BYTES: compact_journal()
+
+def _csv_save(df):
+    _write_base(df)
+    _drop_journal()
+
+# --- مخزن sqlite: فهارس على التاريخ والدورة والتصنيف، وملف CSV يبقى صيغة استيراد/تصدير ---
+INCOME_TYPES = ('دخل', 'الدخل')
+_SQL_COLS = ", ".join(f'"{c}"' for c in LEDGER_COLS)
+_SQL_SCHEMA = """
+CREATE TABLE IF NOT EXISTS ledger (
+    id INTEGER PRIMARY KEY,
+    "التاريخ" TEXT NOT NULL, "اليوم" TEXT, "النوع" TEXT, "التصنيف" TEXT,
+    "المبلغ" REAL NOT NULL DEFAULT 0, "التفاصيل" TEXT, "دورة_الميزانية" TEXT
+);
+CREATE INDEX IF NOT EXISTS ix_ledger_date ON ledger("التاريخ");
+CREATE INDEX IF NOT EXISTS ix_ledger_cycle ON ledger("دورة_الميزانية", "النوع");
+CREATE INDEX IF NOT EXISTS ix_ledger_cat ON ledger("التصنيف", "التاريخ");
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS cycle_summary (
+    cycle TEXT PRIMARY KEY, income REAL NOT NULL DEFAULT 0, expense REAL NOT NULL DEFAULT 0, rows INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+# ملخص لكل دورة (دخل، مصروفات، عدد صفوف) يُحدَّث داخل نفس معاملة كل إدراج أو حذف،
+# فتُحسب الأرقام الكلية للسنوات المؤرشفة منه دون قراءة صفوفها
+_SUMMARY_UPSERT = " ON CONFLICT(cycle) DO UPDATE SET income = income + excluded.income, expense = expense + excluded.expense, rows = rows + excluded.rows"
+
+def _summary_select(sign):
+    inc = f'"النوع" IN {INCOME_TYPES}'
+    return (f'SELECT "دورة_الميزانية", {sign} * sum(CASE WHEN {inc} THEN "المبلغ" ELSE 0 END), '
+            f'{sign} * sum(CASE WHEN {inc} THEN 0 ELSE "المبلغ" END), {sign} * count(*) FROM ledger')
+
+def _summary_add(con, out):
+    inc, amt = out["النوع"].isin(INCOME_TYPES).to_numpy(), out["المبلغ"].to_numpy(dtype=np.float64)
+    g = pd.DataFrame({"c": out["دورة_الميزانية"].to_numpy(), "i": np.where(inc, amt, 0.0), "e": np.where(inc, 0.0, amt), "n": 1}).groupby("c").sum()
+    con.executemany("INSERT INTO cycle_summary VALUES (?, ?, ?, ?)" + _SUMMARY_UPSERT,
+                    [(c, float(i), float(e), int(n)) for c, i, e, n in g.itertuples(name=None)])
+
+def _sql_delete(con, ids):
+    # يطرح الصفوف من ملخصات دوراتها ثم يحذفها
+    if not ids: return
+    con.execute("CREATE TEMP TABLE IF NOT EXISTS gone (id INTEGER PRIMARY KEY)")
+    con.execute("DELETE FROM gone")
+    con.executemany("INSERT OR IGNORE INTO gone VALUES (?)", [(int(i),) for i in ids])
+    con.execute(f"INSERT INTO cycle_summary {_summary_select(-1)} WHERE id IN (SELECT id FROM gone) GROUP BY 1" + _SUMMARY_UPSERT)
+    con.execute("DELETE FROM ledger WHERE id IN (SELECT id FROM gone)")
+    con.execute("DELETE FROM cycle_summary WHERE rows <= 0")
+
+def _sql_insert(con, df, with_ids=False):
+    # يعيد معرفات الصفوف المدرجة؛ with_ids يحفظ الصفوف بمعرفاتها الحالية (فهرس الإطار)
+    df = _coerce_ledger(df.reindex(columns=LEDGER_COLS).copy())
+    if df.empty: return []
+    out = pd.DataFrame({
+        "التاريخ": df['التاريخ'].dt.strftime('%Y-%m-%d %H:%M:%S'),
+        "اليوم": df['اليوم'], "النوع": df['النوع'], "التصنيف": df['التصنيف'],
+        "المبلغ": ledger_amounts(df), "التفاصيل": df['التفاصيل'],
+        "دورة_الميزانية": get_fiscal_cycles(df['التاريخ']).to_numpy(),
+    })
+    _summary_add(con, out)
+    if with_ids:
+        out.insert(0, "id", df.index.to_numpy())
+        out = out.astype(object).where(lambda x: x.notna(), None)
+        con.executemany(f'INSERT INTO ledger (id, {_SQL_COLS}, "دورة_الميزانية") VALUES (?, ?, ?, ?, ?, ?, ?, ?)', out.itertuples(index=False, name=None))
+        return list(df.index)
+    out = out.astype(object).where(lambda x: x.notna(), None)
+    con.executemany(f'INSERT INTO ledger ({_SQL_COLS}, "دورة_الميزانية") VALUES (?, ?, ?, ?, ?, ?, ?)', out.itertuples(index=False, name=None))
+    # المعرفات تُسند متتالية بعد أكبر معرف داخل نفس المعاملة
+    last = con.execute("SELECT max(id) FROM ledger").fetchone()[0]
+    return list(range(last - len(out) + 1, last + 1))
+
+def _sql_connect():
+    con = sqlite3.connect(SQLITE_FILE)
+    con.execute("PRAGMA journal_mode=WAL")
+    con.executescript(_SQL_SCHEMA)
+    if con.execute("SELECT 1 FROM meta WHERE key = 'csv_migrated'").fetchone() is None:
+        # ترحيل لمرة واحدة من ملف CSV القديم (الأساسي + السجل) داخل معاملة واحدة
+        with con:
+            _sql_insert(con, _csv_read())
+            con.execute("INSERT INTO meta VALUES ('csv_migrated', ?)", (datetime.now().isoformat(),))
+    if con.execute("SELECT 1 FROM meta WHERE key = 'summary_built'").fetchone() is None:
+        # قواعد أُنشئت قبل جدول الملخصات: يُبنى مرة واحدة من الصفوف
+        with con:
+            con.execute("DELETE FROM cycle_summary")
+            con.execute(f"INSERT INTO cycle_summary {_summary_select(1)} GROUP BY 1")
+            con.execute("INSERT INTO meta VALUES ('summary_built', ?)", (datetime.now().isoformat(),))
+    return con
+
+def _sql_query(sql, params=()):
+    with closing(_sql_connect()) as con:
+        df = pd.read_sql_query(sql, con, params=params)
+    if 'التاريخ' in df: df['التاريخ'] = pd.to_datetime(df['التاريخ'], errors='coerce')
+    return df
+
+# --- واجهة التخزين: نفس الدوال أياً كان المخزن المختار في STORAGE_BACKEND ---
+def cycle_year(cycle): return cycle_key(cycle) // 12
+
+def _year_cycles(years): return [f"{m:02d}-{y}" for y in sorted(years) for m in range(1, 13)]
+
+def _load_ledger(years=None):
+    # years: سنوات الدورات المطلوبة فقط (أقسام السجل)، أو None للسجل كاملاً
+    if STORAGE_BACKEND == "sqlite":
+        where, params = "", ()
+        if years is not None:
+            params = _year_cycles(years)
+            where = f' WHERE "دورة_الميزانية" IN ({", ".join("?" * len(params))})' if params else " WHERE 0"
+        return _sql_query(f'SELECT id, {_SQL_COLS} FROM ledger{where} ORDER BY id', params).set_index('id').rename_axis(None)
+    df = _csv_read()
+    if years is None: return df
+    return df[(get_fiscal_cycles(df['التاريخ']).map(cycle_key) // 12).isin(list(years)).to_numpy()]
+
+@profiled("load_data")
+def load_data(years=None):
+    try: return _load_ledger(years)
+    except: return pd.DataFrame(columns=LEDGER_COLS)
+
+def cycle_summaries():
+    # (دخل، مصروفات، عدد صفوف) لكل دورة في المخزن كاملاً
+    if STORAGE_BACKEND == "sqlite":
+        return _sql_query("SELECT cycle, income, expense, rows FROM cycle_summary").set_index("cycle")
+    df = _csv_read()
+    inc, amt = df['النوع'].isin(INCOME_TYPES).to_numpy(), ledger_amounts(df).to_numpy()
+    return pd.DataFrame({"cycle": get_fiscal_cycles(df['التاريخ']).to_numpy(), "income": np.where(inc, amt, 0.0),
+                         "expense": np.where(inc, 0.0, amt), "rows": 1}).groupby("cycle").sum()
+
+def _sql_append(rows):
+    with closing(_sql_connect()) as con, con: return _sql_insert(con, rows)
+
+def _sql_replace(df):
+    with closing(_sql_connect()) as con, con:
+        con.execute("DELETE FROM ledger")
+        con.execute("DELETE FROM cycle_summary")
+        _sql_insert(con, df, with_ids=pd.api.types.is_integer_dtype(df.index) and df.index.is_unique)
+
+def _sql_changes(added, changed, deleted):
+    with closing(_sql_connect()) as con, con:
+        _sql_delete(con, list(deleted) + list(changed.index))
+        _sql_insert(con, changed, with_ids=True)
+        return _sql_insert(con, added)
+
+def _csv_enabled(): return STORAGE_BACKEND != "sqlite" or CSV_MIRROR
+
+@profiled("append_rows")
+def append_rows(rows):
+    # يعيد معرفات الصفوف في sqlite، أو None في مخزن CSV (يسندها السجل المشترك)
+    rows = pd.DataFrame(rows)
+    ids = _sql_append(rows) if STORAGE_BACKEND == "sqlite" else None
+    if _csv_enabled(): _csv_append(rows.to_dict('records'))
+    return ids
+
+@profiled("save_data")
+def save_data(df):
+    if STORAGE_BACKEND == "sqlite": _sql_replace(df)
+    if _csv_enabled(): _csv_save(df)
+
+@profiled("save_changes")
+def save_changes(ledger, added, changed, deleted):
+    # حفظ فروقات المحرر فقط: صفوف مضافة، وصفوف معدلة بمعرفاتها، ومعرفات محذوفة
+    ids = _sql_changes(added, changed, deleted) if STORAGE_BACKEND == "sqlite" else None
+    ledger.apply_changes(added, changed, deleted, ids)
+    # ملف CSV لا يدعم التعديل في مكانه، فيُعاد كتابته في وضع CSV أو وضع التوافق
+    if _csv_enabled(): _csv_save(expand_ledger(ledger.frame))
+
+@profiled("query_ledger")
+def query_ledger(ledger, cycle=None, category=None):
+    # صفوف دورة أو تصنيف محدد فقط، مرتبة بالتاريخ
+    if STORAGE_BACKEND == "sqlite":
+        where, params = [], []
+        if cycle is not None: where.append('"دورة_الميزانية" = ?'); params.append(cycle)
+        if category is not None: where.append('"التصنيف" = ?'); params.append(category)
+        return _sql_query(f'SELECT {_SQL_COLS}, "دورة_الميزانية" FROM ledger{" WHERE " + " AND ".join(where) if where else ""} ORDER BY "التاريخ", id', params)
+    df = ledger.frame
+    mask = np.ones(len(df), dtype=bool)
+    if cycle is not None: mask &= (df['دورة_الميزانية'] == cycle).to_numpy()
+    if category is not None: mask &= (df['التصنيف'] == category).to_numpy()
+    return expand_ledger(df[mask]).sort_values('التاريخ', kind='stable')
+
+# --- تجميعات مسبقة (rollup) لكل (دورة، تصنيف، نوع، يوم): تُبنى مرة وتُحدّث تزايدياً مع رقم نسخة البيانات ---
+ROLLUP_KEYS = ['دورة_الميزانية', 'التصنيف', 'النوع', 'التاريخ']
+
+@profiled("build_rollup")
+def build_rollup(df):
+    if df.empty:
+        return pd.DataFrame({'المبلغ': [], 'العدد': []}, index=pd.MultiIndex.from_arrays([[]] * 4, names=ROLLUP_KEYS))
+    dates = pd.to_datetime(df['التاريخ'], errors='coerce')
+    keys = [get_fiscal_cycles(dates).to_numpy(), df['التصنيف'].to_numpy(), df['النوع'].to_numpy(), dates.dt.normalize().to_numpy()]
+    out = ledger_amounts(df).groupby(keys, dropna=False).agg(['sum', 'size'])
+    out.columns = ['المبلغ', 'العدد']; out.index.names = ROLLUP_KEYS
+    return out
+
+@profiled("rollup_merge")
+def rollup_merge(roll, added=None, removed=None):
+    # دمج تجميعات الصفوف المضافة وطرح المحذوفة، وإسقاط المجموعات التي لم يبق فيها صفوف
+    parts = [roll]
+    if added is not None and not added.empty: parts.append(build_rollup(added))
+    if removed is not None and not removed.empty: parts.append(-build_rollup(removed))
+    if len(parts) == 1: return roll
+    out = pd.concat(parts).groupby(level=ROLLUP_KEYS, dropna=False).sum()
+    return out[out['العدد'] > 0]
+
+def _rollup_slice(roll, cycle=None, income=None):
+    mask = np.ones(len(roll), dtype=bool)
+    if cycle is not None: mask &= roll.index.get_level_values('دورة_الميزانية') == cycle
+    if income is not None: mask &= roll.index.get_level_values('النوع').isin(INCOME_TYPES) == income
+    return roll[mask]
+
+def rollup_totals(roll, cycle=None):
+    # (الدخل، المصروفات) لدورة محددة أو لكل السجل
+    return _rollup_slice(roll, cycle, True)['المبلغ'].sum(), _rollup_slice(roll, cycle, False)['المبلغ'].sum()
+
+def rollup_cycles(roll):
+    return sorted([c for c in roll.index.get_level_values('دورة_الميزانية').unique() if c != "None"], key=cycle_key, reverse=True)
+
+def rollup_daily_spend(roll, cycle):
+    daily = _rollup_slice(roll, cycle, False)['المبلغ'].groupby(level='التاريخ').sum()
+    daily.index = daily.index.date
+    return daily
+
+def rollup_by_category(roll, cycle=None, income=None):
+    return _rollup_slice(roll, cycle, income)['المبلغ'].groupby(level='التصنيف').sum()
+
+@profiled("rollup_pivot")
+def rollup_pivot(roll):
+    # مجموع المبالغ لكل (تصنيف × دورة) كما في pivot_table
+    return roll['المبلغ'].groupby(level=['التصنيف', 'دورة_الميزانية']).sum().unstack(fill_value=0)
+
+# --- السجل المضغوط: تصنيفات بأكواد (category) ومبالغ float32 متى كان ذلك بلا فقد حتى الهللة ---
+TEXT_COLS = ['اليوم', 'النوع', 'التصنيف', 'التفاصيل']
+
+def ledger_amounts(df):
+    # المبالغ بدقة float64؛ قيم float32 المضغوطة تُعاد لقيمتها الأصلية بالتقريب لهللتين
+    amt = pd.to_numeric(df['المبلغ'], errors='coerce').fillna(0)
+    return amt.astype(np.float64).round(2) if amt.dtype == np.float32 else amt
+
+def _cycle_categorical(values):
+    values = pd.Categorical(values)
+    return values.set_categories(sorted(values.categories, key=cycle_key), ordered=True)
+
+def _compact_amounts(amt):
+    # float32 إن عادت كل القيم كما هي بالتقريب لهللتين، وإلا float64؛ نوع واحد للعمود كله
+    amt = np.asarray(amt, dtype=np.float64)
+    a32 = amt.astype(np.float32)
+    return a32 if (a32.astype(np.float64).round(2) == amt).all() else amt
+
+@profiled("compact_ledger")
+def compact_ledger(df):
+    df = df.reindex(columns=LEDGER_COLS).copy()
+    df['التاريخ'] = pd.to_datetime(df['التاريخ'], errors='coerce')
+    df['المبلغ'] = _compact_amounts(pd.to_numeric(df['المبلغ'], errors='coerce').fillna(0))
+    # تصنيفات نصية دائماً: عمود فارغ كله (التفاصيل في صفوف الدخل والثوابت) لا يُنتج تصنيفات float ترفض النصوص لاحقاً
+    for c in TEXT_COLS: df[c] = pd.Categorical(df[c].astype(object), categories=pd.Index(df[c].dropna().unique(), dtype=object))
+    df['دورة_الميزانية'] = _cycle_categorical(get_fiscal_cycles(df['التاريخ']))
+    return df
+
+@profiled("expand_ledger")
+def expand_ledger(df):
+    # نسخة بأنواع الأعمدة القديمة (نصوص object و float64) للمحرر والعرض والتصدير
+    df = df.copy()
+    for c in TEXT_COLS + ['دورة_الميزانية']:
+        if c in df and isinstance(df[c].dtype, pd.CategoricalDtype): df[c] = df[c].astype(object)
+    if 'المبلغ' in df: df['المبلغ'] = ledger_amounts(df)
+    return df
+
+def _concat_compact(a, b):
+    if a.empty: return b
+    out = {}
+    for c in a.columns:
+        if isinstance(a[c].dtype, pd.CategoricalDtype):
+            # توسيع التصنيفات بالقيم الجديدة فقط ثم وصل الأكواد، دون إعادة بناء النصوص القديمة
+            cats = a[c].cat.categories
+            vals = b[c].astype(object)
+            extra = [v for v in pd.unique(vals.dropna()) if v not in cats]
+            if extra: cats = pd.Index(list(cats) + extra, dtype=object)
+            codes = np.concatenate([a[c].cat.codes.to_numpy(), pd.Categorical(vals, categories=cats).codes])
+            u = pd.Categorical.from_codes(codes, categories=cats, ordered=a[c].cat.ordered)
+            out[c] = _cycle_categorical(u) if c == 'دورة_الميزانية' and extra else u
+        elif c == 'المبلغ' and a[c].dtype != b[c].dtype:
+            # وصل float32 بـ float64 مباشرة يرفع القيم دون تقريب (12.3 تصبح 12.300000190734863)، فتُعاد لهللاتها أولاً
+            out[c] = _compact_amounts(np.concatenate([ledger_amounts(a).to_numpy(), ledger_amounts(b).to_numpy()]))
+        else: out[c] = np.concatenate([a[c].to_numpy(), b[c].to_numpy()])
+    return pd.DataFrame(out, index=a.index.append(b.index))
+
+_NO_ARCHIVE = pd.DataFrame({"income": [], "expense": [], "rows": []}, index=pd.Index([], name="cycle", dtype=object))
+
+class SharedLedger:
+    # نسخة واحدة من السجل تتشاركها كل الجلسات؛ أي تعديل ينشئ إطاراً جديداً (copy-on-write)
+    # فتبقى الجلسات التي تقرأ النسخة السابقة على لقطتها دون أن تتأثر. فهرس الإطار هو معرف الصف الثابت
+    # archive: ملخصات دورات السنوات غير المحملة في frame (فارغ حين يكون السجل محملاً كاملاً)
+    def __init__(self, df, archive=None):
+        self.lock = threading.Lock()
+        self.frame = compact_ledger(df)
+        self.archive = archive if archive is not None else _NO_ARCHIVE
+        self.version = 0
+        self._rollup = None
+        self._memory = None
+        self._hashes = None
+
+    def _next_ids(self, n):
+        start = int(self.frame.index.max()) + 1 if len(self.frame) else 0
+        return range(start, start + n)
+
+    def append(self, rows, ids=None):
+        self.apply_changes(pd.DataFrame(rows), ids=ids)
+
+    def apply_changes(self, added=None, changed=None, deleted=(), ids=None, archive=None):
+        added = compact_ledger(added if added is not None else pd.DataFrame(columns=LEDGER_COLS))
+        changed = compact_ledger(changed) if changed is not None and not changed.empty else None
+        gone_ids = list(deleted) + (list(changed.index) if changed is not None else [])
+        with self.lock:
+            added.index = ids if ids is not None else self._next_ids(len(added))
+            fresh = self._rollup is not None and self._rollup[0] == self.version
+            frame = self.frame
+            removed = None
+            if gone_ids:
+                gone = frame.index.isin(gone_ids)
+                removed, frame = frame[gone], frame[~gone]
+            if changed is not None: added = _concat_compact(changed, added)
+            frame = _concat_compact(frame, added)
+            self.frame = frame.sort_index() if gone_ids else frame
+            if archive is not None: self.archive = archive
+            self.version += 1
+            if fresh: self._rollup = (self.version, rollup_merge(self._rollup[1], added=added, removed=removed))
+
+    def replace(self, df, archive=None):
+        new = compact_ledger(_coerce_ledger(df.copy()))
+        with self.lock:
+            self.frame = new
+            self.archive = archive if archive is not None else _NO_ARCHIVE
+            self.version += 1
+
+    def archived_years(self): return set(self.archive.index.map(cycle_year))
+
+    def load_partitions(self, df, years):
+        # دمج أقسام سنوات مؤرشفة حُمّلت عند الطلب. ما أُضيف لهذه السنوات بعد البدء موجود في df أيضاً، فيُستبدل بنسخته من المخزن
+        cats = self.frame['دورة_الميزانية'].cat
+        row_years = np.append(np.array([cycle_year(c) for c in cats.categories], dtype=np.int64), -1)[cats.codes.to_numpy()]
+        stale = self.frame.index[np.isin(row_years, list(years))]
+        archive = self.archive[~self.archive.index.map(cycle_year).isin(list(years))]
+        self.apply_changes(df, deleted=list(stale), ids=list(df.index), archive=archive)
+
+    def cycles(self):
+        # كل الدورات، المحملة والمؤرشفة، الأحدث أولاً
+        archived = [c for c in self.archive.index if cycle_key(c) >= 0]
+        return sorted(set(rollup_cycles(self.rollup())) | set(archived), key=cycle_key, reverse=True)
+
+    def all_time_totals(self):
+        # (الدخل، المصروفات) للسجل كاملاً: المحمل من التجميعات، والمؤرشف من ملخصات دوراته دون قراءة صفوفه
+        inc, exp = rollup_totals(self.rollup())
+        return inc + float(self.archive['income'].sum()), exp + float(self.archive['expense'].sum())
+
+    def rollup(self):
+        with self.lock:
+            if self._rollup is None or self._rollup[0] != self.version:
+                self._rollup = (self.version, build_rollup(self.frame))
+            return self._rollup[1]
+
+    def content_index(self):
+        # (بصمات فريدة مرتبة، عدد تكرار كل بصمة) لكشف الصفوف المكررة عند الاستيراد، يُبنى مرة لكل نسخة
+        with self.lock: frame, version = self.frame, self.version
+        if self._hashes is None or self._hashes[0] != version:
+            self._hashes = (version, *np.unique(content_hashes(frame), return_counts=True))
+        return self._hashes[1:]
+
+    def memory_report(self):
+        # (حجم السجل المضغوط، حجمه بالأنواع القديمة) بالبايت، يُحسب مرة لكل نسخة
+        with self.lock: frame, version = self.frame, self.version
+        if self._memory is None or self._memory[0] != version:
+            self._memory = (version, int(frame.memory_usage(deep=True).sum()), int(expand_ledger(frame).memory_usage(deep=True).sum()))
+        return self._memory[1:]
+
+# --- كاتب واحد: كل تعديلات السجل والإعدادات تمر بطابور واحد يعالجه خيط واحد لكل عملية ---
+# الطلبات المتزامنة تُكتب معاً (معاملة sqlite واحدة وكتابة CSV واحدة)، وقفل ملف يمنع تداخل الكتابة بين عمليات الخادم،
+# وملف الختم (stamp) يزيد مع كل كتابة فتعرف العمليات الأخرى أن نسختها قديمة فتعيد التحميل
+CONFIG_FILE = "app_config_persistent.json"
+LOCK_FILE = "finance_master_2026.lock"
+STAMP_FILE = "finance_master_2026.stamp"
+DEFAULT_CONFIG = {"goal": 5000, "services": {}}
+FLUSH_MAX = 256  # أقصى عدد طلبات في دفعة واحدة
+WRITE_TIMEOUT = 120  # ثوانٍ ينتظرها الطلب قبل أن يُبلغ بالفشل (قد يُكتب بعدها إن كان الخيط مشغولاً بدفعة طويلة)
+
+@contextmanager
+def _file_lock():
+    with open(LOCK_FILE, 'a') as f:
+        if fcntl: fcntl.flock(f, fcntl.LOCK_EX)
+        try: yield
+        finally:
+            if fcntl: fcntl.flock(f, fcntl.LOCK_UN)
+
+def _write_atomic(path, text):
+    tmp = path + ".tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write(text); f.flush(); os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+def _read_stamp():
+    try:
+        with open(STAMP_FILE, 'r') as f: return int(f.read() or 0)
+    except (OSError, ValueError): return 0
+
+def load_config():
+    try:
+        with open(CONFIG_FILE, 'r', encoding='utf-8') as f: return json.load(f)
+    except: return {k: (dict(v) if isinstance(v, dict) else v) for k, v in DEFAULT_CONFIG.items()}
+
+def _merge_config(config, patch):
+    # دمج على مستوى القواميس المتداخلة: تعديل ملحوظة خدمة لا يمسح ملحوظات الخدمات الأخرى
+    out = dict(config)
+    for k, v in patch.items(): out[k] = _merge_config(out.get(k) or {}, v) if isinstance(v, dict) else v
+    return out
+
+# --- الأرشيف: السجل مقسم حسب سنة الدورة؛ السنوات الحديثة تُحمّل عند البدء والأقدم عند طلب إحدى دوراتها ---
+HOT_YEARS = 2  # سنة الدورة الحالية والتي قبلها (وما بعدهما)؛ 0 يحمّل السجل كاملاً. الأرشفة لمخزن sqlite فقط
+
+def _archive_enabled(): return STORAGE_BACKEND == "sqlite" and HOT_YEARS > 0
+
+def _first_hot_year(): return cycle_year(get_fiscal_cycle(datetime.now())) - HOT_YEARS + 1
+
+def hot_cycles(cycles):
+    # الدورات التي تُحمّل عند البدء، بغض النظر عما حُمّل بعدها عند الطلب
+    return list(cycles) if not _archive_enabled() else [c for c in cycles if cycle_year(c) >= _first_hot_year()]
+
+@profiled("ledger_state")
+def _ledger_state(years=()):
+    # (صفوف السنوات المحملة، ملخصات دورات باقي السنوات)؛ years سنوات إضافية حُمّلت عند الطلب
+    if not _archive_enabled(): return _load_ledger(), None
+    summ = cycle_summaries()
+    summ_years = summ.index.map(cycle_year)
+    first = _first_hot_year()
+    years = {int(y) for y in summ_years if y >= first} | set(years)
+    return _load_ledger(years), summ[~summ_years.isin(list(years))]
+
+def full_ledger(ledger):
+    # السجل كاملاً بالأنواع القديمة: من الذاكرة إن لم تكن فيه سنوات مؤرشفة، وإلا من المخزن
+    return expand_ledger(ledger.frame if ledger.archive.empty else compact_ledger(_load_ledger()))
+
+class LedgerWriter:
+    # يملك السجل المشترك والإعدادات؛ الجلسات تقرأ منه مباشرة وترسل التعديلات عبر الطابور وتنتظر تأكيد الحفظ
+    def __init__(self):
+        self._extra_years = set()
+        self._mirror_stale, self.mirror_error = False, None
+        with _file_lock():
+            self.stamp = _read_stamp()
+            # خطأ القراءة يُرفع ولا يُستبدل بسجل فارغ: أول حفظ من المحرر أو نسخة CSV كان سيكتبه فوق السجل كله
+            self.ledger = SharedLedger(*_ledger_state())
+            self.config = load_config()
+        self.config_version = 0
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="ledger-writer", daemon=True)
+        self._thread.start()
+
+    def _submit(self, op, *args):
+        # الزمن المقاس هنا يشمل الانتظار في الطابور وكتابة الدفعة كلها
+        with timed(f"writer.{op}"):
+            if not self._thread.is_alive(): raise RuntimeError("خيط الكتابة متوقف")
+            fut = Future()
+            self._queue.put((op, args, fut))
+            return fut.result(timeout=WRITE_TIMEOUT)
+
+    def append(self, rows): return self._submit("append", rows)
+    def save_changes(self, added, changed, deleted): return self._submit("changes", added, changed, deleted)
+    def replace(self, df): return self._submit("replace", df)
+    def update_config(self, patch, replace=False): return self._submit("config", patch, replace)
+
+    def load_cycles(self, cycles):
+        # يحمّل أقسام السنوات المؤرشفة لهذه الدورات إن وُجدت؛ يعيد True إن تغيّر السجل
+        years = self.ledger.archived_years() & {cycle_year(c) for c in cycles}
+        if years: self._submit("load", years)
+        return bool(years)
+
+    @property
+    def version(self): return (self.ledger.version, self.config_version)
+
+    def sync(self):
+        # قراءة ملف صغير فقط؛ إعادة التحميل تتم في خيط الكاتب إن كتبت عملية أخرى
+        if _read_stamp() != self.stamp: self._submit("sync")
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None: return
+            # كل ما وصل أثناء الكتابة السابقة يُكتب في الدفعة التالية، بلا انتظار إضافي حين يكون الطابور هادئاً
+            batch = [item]
+            while len(batch) < FLUSH_MAX:
+                try: item = self._queue.get_nowait()
+                except queue.Empty: break
+                if item is None: self._queue.put(None); break
+                batch.append(item)
+            try: self._flush(batch)
+            except Exception as e:
+                # خطأ قبل معالجة الدفعة (مثل تعذر فتح ملف القفل): تُبلغ طلباتها ويبقى الخيط يستقبل ما بعدها
+                for _, _, fut in batch:
+                    if not fut.done(): fut.set_exception(e)
+
+    @profiled("writer.reload")
+    def _reload(self):
+        # بخلاف load_data لا يُبتلع الخطأ هنا: سجل فارغ بعد قراءة فاشلة قد يُكتب فوق ملف CSV
+        stamp, (df, archive) = _read_stamp(), _ledger_state(self._extra_years)
+        self.ledger.replace(df, archive)
+        self.config, self.config_version, self.stamp = load_config(), self.config_version + 1, stamp
+
+    @profiled("writer.flush", root=True)
+    def _flush(self, batch):
+        # العمليات: append، changes، replace، load (أقسام مؤرشفة)، config، و sync الذي لا يكتب شيئاً:
+        # يكفيه التحقق من الختم أول الدفعة، فإن كتبت عملية أخرى منذ آخر قراءة يُعاد التحميل قبل أي كتابة.
+        # في sqlite يُحفظ كل طلب في معاملته قبل تعديل الذاكرة، فما يفشل بعدها لا يُفشل طلباً محفوظاً (إعادته تكرر صفوفه):
+        # تُعاد قراءة الذاكرة من sqlite، ولا يُبلغ بالخطأ إلا طلب الخطوة التي فشلت
+        sql = STORAGE_BACKEND == "sqlite"
+        results, appended, rewrite, configs, stale = [], [], False, [], False
+        with _file_lock():
+            try:
+                if _read_stamp() != self.stamp: self._reload()
+                # الإضافات المتتالية تُدمج في معاملة واحدة، وباقي الطلبات تُنفذ بترتيب وصولها
+                for op, group in groupby(batch, key=lambda b: b[0]):
+                    group = list(group)
+                    if op == "append":
+                        parts = [pd.DataFrame(args[0]) for _, args, _ in group]
+                        rows = pd.concat(parts, ignore_index=True)
+                        try: ids = _sql_append(rows) if sql else None
+                        except Exception as e:
+                            results += [(fut, e) for _, _, fut in group]
+                            continue
+                        stale |= self._apply_saved(self.ledger.append, rows, ids)
+                        appended.append(rows)
+                        offsets = np.cumsum([0] + [len(p) for p in parts])
+                        results += [(fut, ids[a:b] if ids is not None else None) for (_, _, fut), a, b in zip(group, offsets, offsets[1:])]
+                        continue
+                    for _, args, fut in group:
+                        try:
+                            if op == "changes":
+                                added, changed, deleted = args
+                                ids = _sql_changes(added, changed, deleted) if sql else None
+                                stale |= self._apply_saved(self.ledger.apply_changes, added, changed, deleted, ids); rewrite = True
+                            elif op == "replace":
+                                if sql: _sql_replace(args[0])
+                                if _archive_enabled(): stale |= self._apply_saved(lambda: self.ledger.replace(*_ledger_state(self._extra_years)))
+                                else: stale |= self._apply_saved(self.ledger.replace, args[0])
+                                rewrite = True
+                            elif op == "load":
+                                years = args[0] & self.ledger.archived_years()
+                                if years:
+                                    self.ledger.load_partitions(_load_ledger(years), years)
+                                    self._extra_years |= years
+                            elif op == "config":
+                                patch, replace = args
+                                self.config = dict(patch) if replace else _merge_config(self.config, patch)
+                                self.config_version += 1; configs.append(fut)
+                            elif op == "sync": pass  # أُعيد التحميل أعلاه إن لزم
+                            results.append((fut, None))
+                        except Exception as e: results.append((fut, e))
+                if not sql:
+                    # ملف CSV هو المخزن: يُعاد كتابته مرة واحدة للدفعة إن وُجد تعديل أو استبدال، وإلا تُلحق الإضافات بالسجل
+                    if rewrite: _csv_save(full_ledger(self.ledger))
+                    elif appended: _csv_append(pd.concat(appended, ignore_index=True).to_dict('records'))
+            except Exception as e:
+                # لم يُحفظ شيء (تعذرت القراءة أول الدفعة، أو فشلت كتابة CSV في وضع CSV): تُبلغ كل طلبات الدفعة
+                # وتُعاد القراءة حتى لا تبقى في الذاكرة صفوف لم تُحفظ
+                stale, results = True, [(fut, e) for _, _, fut in batch]
+            else:
+                if sql and CSV_MIRROR: self._mirror(appended, rewrite)
+                if configs:
+                    try: _write_atomic(CONFIG_FILE, json.dumps(self.config, ensure_ascii=False, indent=4))
+                    except Exception as e:
+                        # الإعدادات وحدها لم تُحفظ: تُبلغ طلباتها وتعود الذاكرة إلى ما في الملف
+                        results = [(fut, e if fut in configs else res) for fut, res in results]
+                        configs, self.config, self.config_version = [], load_config(), self.config_version + 1
+                if appended or rewrite or configs:
+                    # داخل القفل وبعد المزامنة أعلاه، الختم على القرص يساوي self.stamp. إن تعذرت كتابته بقي مختلفاً
+                    # عنه، فتُعاد القراءة أول الدفعة التالية ثم يُكتب من جديد؛ الطلبات نفسها محفوظة
+                    self.stamp += 1
+                    try: _write_atomic(STAMP_FILE, str(self.stamp))
+                    except Exception: pass
+            if stale:
+                try: self._reload()
+                except Exception: self.stamp = None  # تُعاد المحاولة أول الدفعة التالية قبل أي كتابة
+        for fut, res in results:
+            if isinstance(res, Exception): fut.set_exception(res)
+            else: fut.set_result(res)
+
+    def _apply_saved(self, fn, *args):
+        # تعديل الذاكرة بعد حفظ الطلب في sqlite؛ يعيد True إن فشل لتُعاد القراءة من المخزن بعد الدفعة.
+        # في وضع CSV لم يُحفظ شيء بعد، فيُرفع الخطأ كما هو
+        try: fn(*args)
+        except Exception:
+            if STORAGE_BACKEND != "sqlite": raise
+            return True
+        return False
+
+    def _mirror(self, appended, rewrite):
+        # وضع التوافق: الصفوف حُفظت في sqlite (المرجع) قبل الوصول هنا، ففشل نسخة CSV لا يُفشل الطلب ولا يُعاد الإدراج؛
+        # تُعاد كتابة النسخة كاملة من sqlite في الدفعة التالية، والخطأ يبقى في mirror_error حتى تنجح
+        try:
+            if rewrite or self._mirror_stale: _csv_save(full_ledger(self.ledger))
+            elif appended: _csv_append(pd.concat(appended, ignore_index=True).to_dict('records'))
+            self._mirror_stale, self.mirror_error = False, None
+        except Exception as e: self._mirror_stale, self.mirror_error = True, e
+
+# --- عرض السجل على صفحات: لا يُرسل للمتصفح إلا الصفحة الظاهرة ---
+PAGE_SIZE = 50
+
+@profiled("ledger_filter")
+def ledger_filter(frame, cycle=None, category=None, start=None, end=None, descending=False):
+    # معرفات الصفوف المطابقة مرتبة بالتاريخ (ثم بالمعرف)، دون نسخ بيانات السجل
+    mask = np.ones(len(frame), dtype=bool)
+    if cycle is not None: mask &= (frame['دورة_الميزانية'] == cycle).to_numpy()
+    if category is not None: mask &= (frame['التصنيف'] == category).to_numpy()
+    if start is not None: mask &= (frame['التاريخ'] >= pd.Timestamp(start)).to_numpy()
+    if end is not None: mask &= (frame['التاريخ'] < pd.Timestamp(end) + pd.Timedelta(days=1)).to_numpy()
+    pos = np.flatnonzero(mask)
+    order = np.argsort(frame['التاريخ'].to_numpy()[pos], kind='stable')
+    return frame.index[pos[order[::-1] if descending else order]]
+
+@profiled("ledger_page")
+def ledger_page(frame, ids, page, size=PAGE_SIZE):
+    return expand_ledger(frame.loc[ids[page * size:(page + 1) * size]])
+
+def page_count(ids, size=PAGE_SIZE): return max(1, -(-len(ids) // size))
+
+def editor_changes(page, state):
+    # تحويل حالة st.data_editor إلى فروقات: (صفوف مضافة، صفوف معدلة بمعرفاتها، معرفات محذوفة)
+    deleted = [page.index[int(p)] for p in state.get("deleted_rows", [])]
+    edits = {page.index[int(p)]: v for p, v in state.get("edited_rows", {}).items()}
+    edits = {i: v for i, v in edits.items() if i not in deleted}
+    changed = page.loc[list(edits), LEDGER_COLS].astype(object)
+    for i, v in edits.items():
+        for c, val in v.items():
+            if c in LEDGER_COLS: changed.at[i, c] = val
+    added = pd.DataFrame(state.get("added_rows", [])).reindex(columns=LEDGER_COLS)
+    # الصفوف بلا تاريخ صالح تُهمل كما يفعل load_data
+    return _coerce_ledger(added).reset_index(drop=True), _coerce_ledger(changed), deleted
+
+# --- الاستيراد على دفعات: تحقق وتحويل لكل دفعة، وكشف المكرر ببصمة المحتوى ---
+IMPORT_CHUNK = 5000
+
+def content_hashes(df):
+    # بصمة لكل صف من (التاريخ، النوع، التصنيف، المبلغ بالهللة، التفاصيل)؛ اليوم لا يدخل لأنه يوم الإدخال لا يوم العملية
+    key = pd.DataFrame({
+        'd': pd.to_datetime(df['التاريخ'], errors='coerce').to_numpy(dtype='datetime64[s]').astype(np.int64),
+        'a': np.round(ledger_amounts(df).to_numpy(dtype=np.float64) * 100).astype(np.int64),
+        **{c: df[c].astype(object).where(df[c].notna(), '').astype(str).to_numpy() for c in ['النوع', 'التصنيف', 'التفاصيل']},
+    })
+    return pd.util.hash_pandas_object(key, index=False).to_numpy()
+
+def _import_batches(up_file):
+    # يقرأ الملف المرفوع دفعة دفعة ويعيد (دفعة، نسبة التقدم)
+    size = max(getattr(up_file, 'size', 0) or 0, 1)
+    if up_file.name.lower().endswith('.xlsx'):
+        from openpyxl import load_workbook
+        wb = load_workbook(up_file, read_only=True, data_only=True)
+        try:
+            ws = wb.active
+            rows = ws.iter_rows(values_only=True)
+            header = [str(h).strip() if h is not None else "" for h in next(rows, ())]
+            total, batch, done = max((ws.max_row or 0) - 1, 1), [], 0
+            for r in rows:
+                batch.append(r[:len(header)])
+                if len(batch) == IMPORT_CHUNK:
+                    done += len(batch)
+                    yield pd.DataFrame(batch, columns=header), min(done / total, 1.0)
+                    batch = []
+            if batch: yield pd.DataFrame(batch, columns=header), 1.0
+        finally: wb.close()
+    else:
+        for chunk in pd.read_csv(up_file, chunksize=IMPORT_CHUNK, encoding='utf-8-sig'):
+            chunk.columns = chunk.columns.str.strip()
+            yield chunk, min(up_file.tell() / size, 1.0)
+
+def validate_batch(batch):
+    # يعيد (الصفوف الصالحة بأعمدة السجل، عدد المرفوض لكل سبب)
+    out = batch.reindex(columns=LEDGER_COLS)
+    dates = pd.to_datetime(out['التاريخ'], errors='coerce')
+    retry = dates.isna() & out['التاريخ'].notna()
+    if retry.any(): dates = dates.where(~retry, pd.to_datetime(out['التاريخ'].where(retry), errors='coerce', format='mixed'))
+    amounts = out['المبلغ']
+    if not pd.api.types.is_numeric_dtype(amounts): amounts = amounts.astype(str).str.replace(',', '').str.strip()
+    amounts = pd.to_numeric(amounts, errors='coerce')
+    bad_date, bad_amt = dates.isna(), amounts.isna() & dates.notna()
+    out['التاريخ'], out['المبلغ'] = dates, amounts
+    rejected = {"تاريخ غير صالح": int(bad_date.sum()), "مبلغ غير صالح": int(bad_amt.sum())}
+    return out[~(bad_date | bad_amt)], {k: v for k, v in rejected.items() if v}
+
+def _new_rows_mask(hashes, uniq, counts, used):
+    # الصف مكرر إن بقي له نظير في السجل لم يُطابَق بعد؛ فتكرار العملية نفسها مرتين في الملف يبقى صحيحاً
+    keep = np.ones(len(hashes), dtype=bool)
+    if not len(uniq): return keep
+    pos = np.minimum(np.searchsorted(uniq, hashes), len(uniq) - 1)
+    for i in np.flatnonzero(uniq[pos] == hashes):
+        h, c = hashes[i], used.get(hashes[i], 0)
+        if c < counts[pos[i]]: used[h] = c + 1; keep[i] = False
+    return keep
+
+@profiled("import_ledger")
+def import_ledger(writer, up_file, mode, progress=None):
+    # mode: "merge" يضيف غير الموجود فقط، "append" يضيف الكل، "replace" يستبدل السجل
+    summary = {"read": 0, "accepted": 0, "duplicates": 0, "rejected": {}}
+    if mode == "merge":
+        # مع وجود سنوات مؤرشفة تُقارن البصمات بالمخزن كاملاً لا بالمحمل فقط
+        ledger, used = writer.ledger, {}
+        uniq, counts = ledger.content_index() if ledger.archive.empty else np.unique(content_hashes(_load_ledger()), return_counts=True)
+    parts = []
+    for batch, frac in _import_batches(up_file):
+        missing = {'التاريخ', 'المبلغ'} - set(batch.columns)
+        if missing: raise ValueError(f"أعمدة مفقودة: {'، '.join(sorted(missing))}")
+        batch = batch.dropna(how='all')
+        summary["read"] += len(batch)
+        ok, rejected = validate_batch(batch)
+        for k, v in rejected.items(): summary["rejected"][k] = summary["rejected"].get(k, 0) + v
+        if mode == "merge" and not ok.empty:
+            keep = _new_rows_mask(content_hashes(ok), uniq, counts, used)
+            summary["duplicates"] += int((~keep).sum()); ok = ok[keep]
+        parts.append(ok)
+        if progress: progress(frac, summary)
+    new = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=LEDGER_COLS)
+    summary["accepted"] = len(new)
+    if mode == "replace":
+        if new.empty: raise ValueError("لا توجد صفوف صالحة في الملف، لم يُستبدل السجل")
+        writer.replace(new)
+    elif not new.empty: writer.append(new)
+    return summary
+
+# --- الترند: تجميع على الخادم ثم تقليل النقاط مع الحفاظ على الشكل ---
+TREND_RESOLUTIONS = ["خام", "يومي", "أسبوعي", "دورة مالية"]
+TREND_MAX_POINTS = 400
+
+@profiled("trend_series")
+def trend_series(item_df, resolution):
+    # (x, y) للبند بعد التجميع حسب الدقة المختارة
+    dates, amounts = item_df['التاريخ'], ledger_amounts(item_df)
+    if resolution == "يومي": g = amounts.groupby(dates.dt.normalize()).sum()
+    elif resolution == "أسبوعي": g = amounts.groupby(dates.dt.to_period('W').dt.start_time).sum()
+    elif resolution == "دورة مالية":
+        g = amounts.groupby(get_fiscal_cycles(dates).to_numpy()).sum()
+        g = g.iloc[np.argsort([cycle_key(c) for c in g.index], kind='stable')]
+    else: return dates.to_numpy(), amounts.to_numpy()
+    return g.index.to_numpy(), g.to_numpy()
+
+@profiled("lttb")
+def lttb(x, y, n):
+    # Largest-Triangle-Three-Buckets: مواقع n نقطة تحفظ شكل المنحنى (الأولى والأخيرة دائماً)
+    size = len(y)
+    if n >= size or n < 3: return np.arange(size)
+    xs, ys = np.asarray(x, dtype=np.float64), np.asarray(y, dtype=np.float64)
+    edges = np.linspace(1, size - 1, n - 1).astype(int)
+    keep = np.empty(n, dtype=np.int64); keep[0], keep[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        lo, hi = edges[i], edges[i + 1]
+        nlo, nhi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (size - 1, size)
+        cx, cy = xs[nlo:nhi].mean(), ys[nlo:nhi].mean()
+        area = np.abs((xs[a] - cx) * (ys[lo:hi] - ys[a]) - (xs[a] - xs[lo:hi]) * (cy - ys[a]))
+        a = lo + int(area.argmax()); keep[i + 1] = a
+    return keep
+
+# --- تحليلات في الخلفية: توقع مصروف نهاية الدورة لكل بند يومي، وعمليات غير معتادة مقارنة بتاريخ البند ---
+# الحساب يتم في عملية منفصلة (ProcessPoolExecutor) على مدخلات صغيرة، والنتائج تُحفظ لكل (دورة، نسخة بيانات)
+ANALYTICS_WORKERS = 1
+ANALYTICS_HISTORY = 12  # عدد الدورات السابقة التي يُقاس عليها
+ANOMALY_Z = 3.5  # حد الانحراف المتين (median/MAD على لوغاريتم المبلغ، فالمصروفات ملتوية) لاعتبار العملية غير معتادة
+ANOMALY_MIN_HISTORY = 8  # أقل عدد عمليات سابقة للبند قبل الحكم على عملية فيه
+
+@profiled("analytics_inputs")
+def analytics_inputs(frame, cycle, as_of=None):
+    # مصروفات DAILY_CATS للدورة ولآخر ANALYTICS_HISTORY دورة قبلها، وإجماليات الدورة؛ كل ما يحتاجه cycle_analytics
+    key = cycle_key(cycle)
+    cyc = frame['دورة_الميزانية'].cat
+    keys = np.append(np.array([cycle_key(c) for c in cyc.categories], dtype=np.int64), -1)[cyc.codes.to_numpy()]
+    income = frame['النوع'].isin(INCOME_TYPES).to_numpy()
+    daily = frame['التصنيف'].isin(DAILY_CATS).to_numpy() & ~income
+    amounts = ledger_amounts(frame).to_numpy(dtype=np.float64)
+    in_cycle = keys == key
+    window = daily & (keys <= key) & (keys >= key - ANALYTICS_HISTORY)
+    return {
+        "cycle": cycle, "as_of": pd.Timestamp(as_of or datetime.now()).normalize(),
+        "income": float(amounts[in_cycle & income].sum()), "other_expense": float(amounts[in_cycle & ~income & ~daily].sum()),
+        "rows": pd.DataFrame({"id": frame.index[window], "التاريخ": frame['التاريخ'].to_numpy()[window],
+                              "التصنيف": frame['التصنيف'].astype(object).to_numpy()[window], "المبلغ": amounts[window], "cycle_key": keys[window]}),
+    }
+
+def cycle_analytics(inputs):
+    # تُنفذ في عملية العامل: لا تعتمد إلا على المدخلات ودوال الدورات
+    cycle, rows = inputs["cycle"], inputs["rows"]
+    key = cycle_key(cycle)
+    start, end = get_cycle_range(cycle)
+    total = (end - start).days + 1
+    elapsed = int(np.clip((inputs["as_of"].date() - start).days + 1, 0, total))
+    cur, hist = rows[rows["cycle_key"] == key], rows[rows["cycle_key"] < key]
+    by_cat = lambda r: r.groupby("التصنيف")["المبلغ"].sum().reindex(DAILY_CATS, fill_value=0.0)
+    # الوتيرة من العمليات حتى اليوم فقط؛ المسجلة بتاريخ لاحق محسوبة في المصروف لكنها لا تُضاعف التوقع
+    spent, spent_now = by_cat(cur), by_cat(cur[cur["التاريخ"] <= inputs["as_of"]])
+    # معدل الصرف اليومي التاريخي: مجموع البند في كل دورة سابقة على طول تلك الدورة، بمتوسط على الدورات
+    hist_keys = np.unique(hist["cycle_key"].to_numpy())
+    if len(hist_keys):
+        spans = get_cycle_ranges([cycle_label(int(k)) for k in hist_keys])
+        days = pd.Series(((spans["end"] - spans["start"]).dt.days + 1).to_numpy(), index=hist_keys)
+        per = hist.groupby(["التصنيف", "cycle_key"])["المبلغ"].sum().unstack(fill_value=0.0).reindex(columns=hist_keys, fill_value=0.0)
+        hist_rate = per.div(days, axis=1).mean(axis=1).reindex(DAILY_CATS, fill_value=0.0)
+    else: hist_rate = None
+    # كلما تقدمت الدورة زاد وزن وتيرتها الحالية على المعدل التاريخي
+    pace = spent_now / elapsed if elapsed else spent_now * 0.0
+    rate = pace if hist_rate is None else (elapsed / total) * pace + (1 - elapsed / total) * hist_rate
+    projected = np.maximum(spent, spent_now + rate * (total - elapsed))
+    cats = pd.DataFrame({"المصروف حتى الآن": spent, "المتوقع نهاية الدورة": projected,
+                         "متوسط الدورات السابقة": (hist_rate * total) if hist_rate is not None else np.nan})
+    cats = cats[(cats["المصروف حتى الآن"] > 0) | (cats["المتوقع نهاية الدورة"] > 0)].sort_values("المتوقع نهاية الدورة", ascending=False)
+    flags = []
+    for cat, g in cur.groupby("التصنيف"):
+        h = np.log1p(np.clip(hist.loc[hist["التصنيف"] == cat, "المبلغ"].to_numpy(), 0, None))
+        if len(h) < ANOMALY_MIN_HISTORY: continue
+        med = float(np.median(h))
+        scale = 1.4826 * float(np.median(np.abs(h - med))) or float(h.std())
+        if scale <= 0: continue
+        z = (np.log1p(np.clip(g["المبلغ"].to_numpy(), 0, None)) - med) / scale
+        hit = z > ANOMALY_Z
+        if hit.any(): flags.append(g[hit].assign(**{"الوسيط المعتاد": float(np.expm1(med)), "الانحراف": z[hit]}).drop(columns="cycle_key"))
+    anomalies = pd.concat(flags).sort_values("الانحراف", ascending=False) if flags else pd.DataFrame(columns=["id", "التاريخ", "التصنيف", "المبلغ", "الوسيط المعتاد", "الانحراف"])
+    projected_expense = float(projected.sum()) + inputs["other_expense"]
+    return {"cycle": cycle, "as_of": inputs["as_of"], "elapsed_days": elapsed, "total_days": total, "categories": cats,
+            "income": inputs["income"], "projected_expense": projected_expense,
+            "projected_remaining": inputs["income"] - projected_expense, "anomalies": anomalies.set_index("id")}
+
+def _analytics_pool():
+    # spawn لا fork: العملية الأم (خادم ستريمليت) متعددة الخيوط. بيئة تمنع العمليات الفرعية تكتفي بخيط
+    try: return ProcessPoolExecutor(ANALYTICS_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    except (OSError, NotImplementedError, ValueError): return ThreadPoolExecutor(ANALYTICS_WORKERS)
+
+class CycleAnalytics:
+    # get لا تنتظر أبداً: تعيد آخر نتيجة مكتملة للدورة وتطلب حساب نسخة البيانات الحالية إن لم تكن محسوبة
+    def __init__(self, max_results=64):
+        self.lock = threading.Lock()
+        self.max_results = max_results
+        self._pool = None
+        # المفتاح (دورة، نسخة، يوم): الإسقاط يعتمد على الأيام المنقضية، فنتيجة الأمس قديمة ولو لم تتغير البيانات
+        self._jobs = {}  # مفتاح -> Future
+        self._done = OrderedDict()  # مفتاح -> نتيجة
+        self._latest = {}  # دورة -> أحدث نتيجة مكتملة لأي نسخة ويوم
+        self._failed = set()  # مفاتيح فشل حسابها فلا يُعاد طلبها مع كل تحديث للصفحة
+        self.last_error = None
+
+    def get(self, ledger, cycle, as_of=None):
+        # (آخر نتيجة مكتملة أو None، هل هي لنسخة البيانات الحالية ولليوم)
+        if cycle_key(cycle) < 0: return None, True
+        with ledger.lock: frame, version = ledger.frame, ledger.version
+        as_of = pd.Timestamp(as_of or datetime.now()).normalize()
+        key = (cycle, version, as_of)
+        with self.lock:
+            if key in self._done:
+                self._done.move_to_end(key)
+                return self._done[key], True
+            if key in self._jobs: return self._latest.get(cycle), False
+            if key in self._failed: return self._latest.get(cycle), True
+        inputs = analytics_inputs(frame, cycle, as_of)
+        with self.lock:
+            latest = self._latest.get(cycle)
+            if key in self._jobs or key in self._done: return latest, key in self._done
+            # طلبات نسخ أو أيام أقدم لنفس الدورة لم تبدأ بعد لا فائدة منها
+            stale = [f for (c, v, d), f in self._jobs.items() if c == cycle and (v, d) < (version, as_of)]
+            if self._pool is None: self._pool = _analytics_pool()
+            try: fut = self._pool.submit(cycle_analytics, inputs)
+            except (BrokenExecutor, RuntimeError):
+                # عملية العامل توقفت: يكمل الحساب في خيط داخل العملية
+                self._pool = ThreadPoolExecutor(ANALYTICS_WORKERS)
+                fut = self._pool.submit(cycle_analytics, inputs)
+            self._jobs[key] = fut
+        # خارج القفل: cancel وإضافة callback لمهمة منتهية تستدعيان _finish فوراً في هذا الخيط، و _finish تأخذ القفل نفسه
+        for f in stale: f.cancel()
+        fut.add_done_callback(lambda f, key=key: self._finish(key, f))
+        return latest, False
+
+    def pending(self, cycle, version):
+        with self.lock: return any(k[:2] == (cycle, version) for k in self._jobs)
+
+    def _finish(self, key, fut):
+        with self.lock:
+            self._jobs.pop(key, None)
+            if fut.cancelled(): return
+            try: result = fut.result()
+            except BrokenExecutor as e:
+                self.last_error = e  # يُعاد الطلب التالي في خيط (انظر get)
+                return
+            except Exception as e:
+                self.last_error = e
+                self._failed.add(key)
+                return
+            result["version"], result["computed_at"] = key[1], datetime.now()
+            self._done[key] = result
+            while len(self._done) > self.max_results: self._done.popitem(last=False)
+            latest = self._latest.get(key[0])
+            if latest is None or (latest["version"], latest["as_of"]) <= key[1:]: self._latest[key[0]] = result
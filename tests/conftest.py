@@ -0,0 +1,37 @@
+import os, sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import finance_engine as fe
+
+STORE_FILES = {"DB_FILE": "ledger.csv", "JOURNAL_FILE": "journal.jsonl", "SQLITE_FILE": "ledger.db",
+               "CONFIG_FILE": "config.json", "LOCK_FILE": "ledger.lock", "STAMP_FILE": "ledger.stamp"}
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    # كل ملفات التخزين في مجلد مؤقت، بمخزن sqlite دون نسخة CSV؛ الاختبار يغيّر STORAGE_BACKEND و CSV_MIRROR عند الحاجة
+    for name, f in STORE_FILES.items(): monkeypatch.setattr(fe, name, str(tmp_path / f))
+    monkeypatch.setattr(fe, "STORAGE_BACKEND", "sqlite")
+    monkeypatch.setattr(fe, "CSV_MIRROR", False)
+    return tmp_path
+
+@pytest.fixture
+def mirror(store, monkeypatch):
+    # وضع التوافق: نسخة CSV تُحدّث مع كل كتابة في sqlite
+    monkeypatch.setattr(fe, "CSV_MIRROR", True)
+
+@pytest.fixture
+def writer(store):
+    w = fe.LedgerWriter()
+    yield w
+    w.close()
+
+def make_rows(amounts, start="2026-01-01", cat="بنزين", kind="مصروف", details=None):
+    # صف لكل مبلغ، بتواريخ متتالية يوماً بيوم
+    dates = pd.date_range(start, periods=len(amounts))
+    return pd.DataFrame({"التاريخ": dates, "اليوم": "الخميس", "النوع": kind, "التصنيف": cat, "المبلغ": amounts, "التفاصيل": details})
+
+@pytest.fixture
+def rows(): return make_rows
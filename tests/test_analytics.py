@@ -0,0 +1,86 @@
+import threading, time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import finance_engine as fe
+
+def history(cycles=13, per_cycle=20, end="2026-01-20"):
+    # مصروفات يومية معتادة على عدة دورات تنتهي في دورة end
+    rng = np.random.default_rng(0)
+    dates = pd.date_range(end=end, periods=cycles * 30, freq="D")
+    dates = dates[rng.integers(0, len(dates), cycles * per_cycle)]
+    return pd.DataFrame({"التاريخ": dates, "اليوم": "x", "النوع": "مصروف", "التصنيف": "بنزين",
+                         "المبلغ": rng.gamma(4.0, 20.0, len(dates)).round(2), "التفاصيل": None})
+
+def wait(fn, timeout=30):
+    # يشغّل fn في خيط ويفشل الاختبار بدل أن يعلق إن لم تنتهِ
+    out, t = [], threading.Thread(target=lambda: out.append(fn()), daemon=True)
+    t.start(); t.join(timeout)
+    assert not t.is_alive(), "CycleAnalytics.get لم تعد (قفل متبادل؟)"
+    return out[0]
+
+def settle(analytics, ledger, cycle, as_of=None, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        result, fresh = wait(lambda: analytics.get(ledger, cycle, as_of))
+        if fresh: return result
+        time.sleep(0.05)
+    pytest.fail("لم تكتمل التحليلات")
+
+@pytest.fixture(params=["thread", "process"])
+def analytics(request, monkeypatch):
+    if request.param == "thread":
+        monkeypatch.setattr(fe, "_analytics_pool", lambda: ThreadPoolExecutor(fe.ANALYTICS_WORKERS))
+        # العامل مشغول فتبقى الطلبات التالية معلقة قابلة للإلغاء
+        slow = fe.cycle_analytics
+        monkeypatch.setattr(fe, "cycle_analytics", lambda inputs: (time.sleep(0.2), slow(inputs))[1])
+    a = fe.CycleAnalytics()
+    yield a
+    if a._pool is not None: a._pool.shutdown(cancel_futures=True)
+
+def test_rapid_versions_do_not_deadlock(analytics):
+    ledger = fe.SharedLedger(history())
+    cycle = fe.get_fiscal_cycle(ledger.frame['التاريخ'].max())
+    for i in range(5):
+        wait(lambda: analytics.get(ledger, cycle))
+        ledger.append(history(cycles=1, per_cycle=1, end="2026-01-10"))
+    result = settle(analytics, ledger, cycle)
+    assert result["version"] == ledger.version
+    assert not analytics.pending(cycle, ledger.version)
+
+def test_get_serves_latest_result_while_recomputing(analytics):
+    ledger = fe.SharedLedger(history())
+    cycle = fe.get_fiscal_cycle(ledger.frame['التاريخ'].max())
+    first = settle(analytics, ledger, cycle)
+    ledger.append(history(cycles=1, per_cycle=1, end="2026-01-10"))
+    result, fresh = wait(lambda: analytics.get(ledger, cycle))
+    assert result is first and not fresh
+
+def test_past_cycle_projects_actual_spend():
+    frame = fe.compact_ledger(history())
+    cycle = "12-2025"
+    out = fe.cycle_analytics(fe.analytics_inputs(frame, cycle, as_of="2026-06-01"))
+    spent = fe.ledger_amounts(frame)[(frame['دورة_الميزانية'] == cycle).to_numpy()].sum()
+    assert out["elapsed_days"] == out["total_days"]
+    assert out["projected_expense"] == pytest.approx(spent)
+
+def test_large_outlier_is_flagged():
+    df = history()
+    spike = df.iloc[[0]].assign(**{"التاريخ": pd.Timestamp("2026-01-15"), "المبلغ": 5000.0})
+    frame = fe.compact_ledger(pd.concat([df, spike], ignore_index=True))
+    out = fe.cycle_analytics(fe.analytics_inputs(frame, "01-2026", as_of="2026-01-16"))
+    assert out["anomalies"]["المبلغ"].tolist() == [5000.0]
+
+def test_result_from_earlier_day_is_stale(analytics):
+    ledger = fe.SharedLedger(history())
+    cycle = fe.get_fiscal_cycle(ledger.frame['التاريخ'].max())
+    day, next_day = pd.Timestamp("2026-01-20"), pd.Timestamp("2026-01-21")
+    first = settle(analytics, ledger, cycle, day)
+    # البيانات لم تتغير، لكن يوماً آخر انقضى من الدورة
+    result, fresh = wait(lambda: analytics.get(ledger, cycle, next_day))
+    assert result is first and not fresh
+    second = settle(analytics, ledger, cycle, next_day)
+    assert second["as_of"] == next_day and second["elapsed_days"] == first["elapsed_days"] + 1
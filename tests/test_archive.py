@@ -0,0 +1,27 @@
+import pandas as pd
+
+import finance_engine as fe
+
+def test_archived_years_load_on_demand(store, rows, monkeypatch):
+    recent = (pd.Timestamp.now() - pd.Timedelta(days=40)).strftime('%Y-%m-%d')
+    fe.save_data(pd.concat([rows([1.0], start="2019-03-01"), rows([2.0], start=recent)], ignore_index=True))
+    monkeypatch.setattr(fe, "HOT_YEARS", 2)
+    w = fe.LedgerWriter()
+    try:
+        assert w.ledger.archived_years() == {2019}
+        assert w.ledger.all_time_totals() == (0.0, 3.0)
+        assert w.load_cycles(["03-2019"]) and not w.ledger.archived_years()
+        assert sorted(fe.ledger_amounts(w.ledger.frame).tolist()) == [1.0, 2.0]
+    finally: w.close()
+
+def test_hot_cycles_ignore_loaded_partitions(store, rows, monkeypatch):
+    recent = (pd.Timestamp.now() - pd.Timedelta(days=40)).strftime('%Y-%m-%d')
+    fe.save_data(pd.concat([rows([1.0], start="2019-03-01"), rows([2.0], start=recent)], ignore_index=True))
+    monkeypatch.setattr(fe, "HOT_YEARS", 2)
+    w = fe.LedgerWriter()
+    try:
+        before = fe.hot_cycles(w.ledger.cycles())
+        assert before == [fe.get_fiscal_cycle(pd.Timestamp(recent))]
+        w.load_cycles(["03-2019"])
+        assert fe.hot_cycles(w.ledger.cycles()) == before
+    finally: w.close()
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+import finance_engine as fe
+
+def test_compact_uses_float32_only_when_lossless(rows):
+    assert fe.compact_ledger(rows([12.3, 45.67]))['المبلغ'].dtype == np.float32
+    assert fe.compact_ledger(rows([1234567.891]))['المبلغ'].dtype == np.float64
+
+def test_expand_restores_exact_amounts(rows):
+    df = rows([12.3, 45.67, 0.01, 99999.99])
+    assert fe.expand_ledger(fe.compact_ledger(df))['المبلغ'].tolist() == [12.3, 45.67, 0.01, 99999.99]
+
+def test_mixed_batches_keep_cent_values(rows):
+    ledger = fe.SharedLedger(rows([12.3, 45.67]))
+    ledger.append(rows([1234567.891]))
+    assert ledger.frame['المبلغ'].dtype == np.float64
+    assert fe.expand_ledger(ledger.frame)['المبلغ'].tolist() == [12.3, 45.67, 1234567.891]
+    assert fe.rollup_totals(ledger.rollup())[1] == 12.3 + 45.67 + 1234567.891
+
+def test_float64_frame_takes_float32_batch(rows):
+    ledger = fe.SharedLedger(rows([1234567.891]))
+    ledger.append(rows([12.3]))
+    assert ledger.frame['المبلغ'].tolist() == [1234567.891, 12.3]
+
+def test_edits_keep_amounts(rows):
+    ledger = fe.SharedLedger(rows([12.3, 45.67, 7.5]))
+    changed = fe.expand_ledger(ledger.frame.loc[[1]]).assign(**{'المبلغ': 1234567.891})
+    ledger.apply_changes(rows([8.2]), changed, deleted=[0])
+    assert sorted(fe.ledger_amounts(ledger.frame).tolist()) == [7.5, 8.2, 1234567.891]
+
+def test_categorical_columns_extend_with_new_values(rows):
+    ledger = fe.SharedLedger(rows([1.0], cat="بنزين"))
+    ledger.append(rows([2.0], cat="مقاهي", start="2026-03-01"))
+    out = fe.expand_ledger(ledger.frame)
+    assert out['التصنيف'].tolist() == ["بنزين", "مقاهي"]
+    assert list(ledger.frame['دورة_الميزانية'].cat.categories) == sorted(out['دورة_الميزانية'].unique(), key=fe.cycle_key)
+
+def test_full_ledger_mirror_has_no_float_noise(mirror, writer, rows):
+    writer.append(rows([12.3, 45.67]))
+    writer.append(rows([1234567.891]))
+    writer.save_changes(rows([0.0]).iloc[:0], fe.expand_ledger(writer.ledger.frame.iloc[[0]]), [])
+    text = open(fe.DB_FILE, encoding='utf-8-sig').read()
+    assert "12.3," in text and "12.30000" not in text
+    assert sorted(pd.read_csv(fe.DB_FILE)['المبلغ'].tolist()) == [12.3, 45.67, 1234567.891]
+
+# صف من نموذج الدخل أو الثوابت: بلا مفتاح التفاصيل أصلاً
+INCOME_ROW = {"التاريخ": pd.Timestamp("2026-01-05"), "اليوم": "الإثنين", "النوع": "دخل", "التصنيف": "الراتب", "المبلغ": 100.0}
+
+def test_text_after_all_empty_column(rows):
+    ledger = fe.SharedLedger(pd.DataFrame(columns=fe.LEDGER_COLS))
+    ledger.append([INCOME_ROW])
+    ledger.append(rows([5.0], details="إدخال متعدد"))
+    assert fe.expand_ledger(ledger.frame)['التفاصيل'].tolist()[1] == "إدخال متعدد"
+
+def test_writer_bulk_after_income_on_fresh_store(writer, rows):
+    writer.append([INCOME_ROW])
+    writer.append(rows([5.0, 6.0], details="إدخال متعدد"))
+    assert len(writer.ledger.frame) == 3 and len(fe._load_ledger()) == 3
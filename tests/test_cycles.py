@@ -0,0 +1,72 @@
+from datetime import date, timedelta
+
+import pandas as pd
+import pytest
+
+import finance_engine as fe
+
+# الدوال الأصلية كما كانت في app.py قبل التحويل إلى المحرك المتجه؛ المرجع لكل المقارنات هنا
+def orig_salary_day(year, month):
+    try:
+        t_27 = date(int(year), int(month), 27)
+        return 26 if t_27.weekday() == 4 else (28 if t_27.weekday() == 5 else 27)
+    except: return 27
+
+def orig_fiscal_cycle(dt):
+    if pd.isna(dt): return "None"
+    sd = orig_salary_day(dt.year, dt.month)
+    if dt.day >= sd: return (dt + pd.DateOffset(months=1)).strftime("%m-%Y")
+    return dt.strftime("%m-%Y")
+
+def orig_cycle_range(cycle_str):
+    try:
+        month, year = map(int, cycle_str.split('-'))
+        curr_month_start = date(year, month, 1)
+        prev_month_end = curr_month_start - timedelta(days=1)
+        start_day = orig_salary_day(prev_month_end.year, prev_month_end.month)
+        start_date = date(prev_month_end.year, prev_month_end.month, start_day)
+        end_day = orig_salary_day(year, month)
+        end_date = date(year, month, end_day) - timedelta(days=1)
+        return start_date, end_date
+    except: return None, None
+
+def test_salary_day_matches_original():
+    for y in [1999, 2024, 2026, 2031, 2150]:
+        for m in range(0, 14):
+            assert fe.get_salary_day(y, m) == orig_salary_day(y, m), (y, m)
+
+def test_fiscal_cycles_match_original_daily():
+    dates = pd.Series(pd.date_range("2019-12-01", "2031-01-31", freq="D"))
+    expected = [orig_fiscal_cycle(d) for d in dates]
+    assert fe.get_fiscal_cycles(dates).tolist() == expected
+
+def test_fiscal_cycles_keep_index_and_invalid_dates():
+    dates = pd.Series([pd.Timestamp("2026-01-27 23:59"), None, "not a date", pd.Timestamp("2026-02-26")], index=[10, 11, 12, 13])
+    out = fe.get_fiscal_cycles(dates)
+    assert out.index.tolist() == [10, 11, 12, 13]
+    assert out.tolist() == [orig_fiscal_cycle(pd.Timestamp("2026-01-27 23:59")), "None", "None", orig_fiscal_cycle(pd.Timestamp("2026-02-26"))]
+    assert fe.get_fiscal_cycle(None) == "None"
+
+@pytest.mark.parametrize("years", [range(1, 5), range(1999, 2032), range(9997, 10001)])
+def test_cycle_range_matches_original(years):
+    labels = [f"{m:02d}-{y}" for y in years for m in range(0, 14)]
+    for c in labels: assert fe.get_cycle_range(c) == orig_cycle_range(c), c
+
+@pytest.mark.parametrize("label", ["None", "", "abc", "1-2026", "01-26", "01-0001", "01-10000", None])
+def test_cycle_range_edge_labels(label):
+    expected = orig_cycle_range(label) if isinstance(label, str) else (None, None)
+    assert fe.get_cycle_range(label) == expected
+
+def test_cycle_ranges_column_matches_scalar():
+    labels = ["12-2025", "01-2026", "None", "01-0001", "03-2026"]
+    ranges = fe.get_cycle_ranges(labels)
+    for c, (start, end) in zip(labels, ranges.itertuples(index=False)):
+        expected = fe.get_cycle_range(c)
+        got = (None, None) if pd.isna(start) else (start.date(), end.date())
+        assert got == expected
+
+def test_cycle_key_sorts_like_strptime():
+    labels = ["02-2026", "12-2025", "01-2026", "None", "11-2024"]
+    valid = [c for c in labels if c != "None"]
+    assert sorted(valid, key=fe.cycle_key) == sorted(valid, key=lambda c: pd.to_datetime(c, format="%m-%Y"))
+    assert fe.cycle_key("None") == -1 and fe.cycle_label(fe.cycle_key("07-2026")) == "07-2026"
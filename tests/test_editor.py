@@ -0,0 +1,53 @@
+import os
+
+import finance_engine as fe
+
+def first_page(ledger):
+    ids = fe.ledger_filter(ledger.frame)
+    return fe.ledger_page(ledger.frame, ids, 0)
+
+def test_editor_changes_split_deltas(rows):
+    ledger = fe.SharedLedger(rows([10.0, 20.0, 30.0, 40.0]))
+    page = first_page(ledger)
+    state = {
+        "edited_rows": {0: {"المبلغ": 11.5, "التفاصيل": "تعديل"}, 2: {"المبلغ": 99.0}},
+        "added_rows": [{"التاريخ": "2026-02-01", "النوع": "مصروف", "التصنيف": "مقاهي", "المبلغ": 5}, {"المبلغ": 3}],
+        "deleted_rows": [2, 3],
+    }
+    added, changed, deleted = fe.editor_changes(page, state)
+    # الصف المعدل ثم المحذوف يُحذف فقط، والصف المضاف بلا تاريخ يُهمل
+    assert deleted == [page.index[2], page.index[3]]
+    assert changed.index.tolist() == [page.index[0]]
+    assert changed.loc[page.index[0], 'المبلغ'] == 11.5 and changed.loc[page.index[0], 'التفاصيل'] == "تعديل"
+    assert changed.loc[page.index[0], 'التصنيف'] == "بنزين"
+    assert len(added) == 1 and added.loc[0, 'التصنيف'] == "مقاهي"
+
+def test_editor_changes_use_page_positions(rows):
+    ledger = fe.SharedLedger(rows([float(i) for i in range(120)]))
+    ids = fe.ledger_filter(ledger.frame)
+    page = fe.ledger_page(ledger.frame, ids, 1)
+    _, changed, deleted = fe.editor_changes(page, {"edited_rows": {"0": {"المبلغ": -1.0}}, "deleted_rows": [1]})
+    assert changed.index.tolist() == [ids[fe.PAGE_SIZE]] and deleted == [ids[fe.PAGE_SIZE + 1]]
+
+def test_no_edits_no_deltas(rows):
+    page = first_page(fe.SharedLedger(rows([1.0, 2.0])))
+    added, changed, deleted = fe.editor_changes(page, {})
+    assert added.empty and changed.empty and deleted == []
+
+def test_save_changes_persists_only_deltas(writer, rows):
+    writer.append(rows([10.0, 20.0, 30.0]))
+    page = first_page(writer.ledger)
+    added, changed, deleted = fe.editor_changes(page, {
+        "edited_rows": {1: {"المبلغ": 25.0}}, "deleted_rows": [0],
+        "added_rows": [{"التاريخ": "2026-01-05", "النوع": "مصروف", "التصنيف": "مقاهي", "المبلغ": 7.0}],
+    })
+    writer.save_changes(added, changed, deleted)
+    stored = fe._load_ledger()
+    assert sorted(stored['المبلغ'].tolist()) == [7.0, 25.0, 30.0]
+    # المعدل يحتفظ بمعرفه، والمحذوف لا يعود
+    assert stored.loc[page.index[1], 'المبلغ'] == 25.0 and page.index[0] not in stored.index
+    assert sorted(fe.ledger_amounts(writer.ledger.frame).tolist()) == [7.0, 25.0, 30.0]
+    summ = fe.cycle_summaries()
+    assert summ['expense'].sum() == 62.0 and summ['rows'].sum() == 3
+    # دون نسخة CSV لا يُعاد كتابة أي ملف بحجم السجل
+    assert not os.path.exists(fe.DB_FILE)
@@ -0,0 +1,71 @@
+import io
+
+import pytest
+
+import finance_engine as fe
+
+def upload(df, name="restore.csv"):
+    # كائن يشبه ملف st.file_uploader: قابل للقراءة وله name و size
+    data = df.to_csv(index=False).encode('utf-8-sig')
+    f = io.BytesIO(data)
+    f.name, f.size = name, len(data)
+    return f
+
+def test_merge_skips_existing_rows(writer, rows):
+    writer.append(rows([10.0, 20.0, 30.0]))
+    incoming = rows([10.0, 20.0, 30.0, 40.0])
+    summary = fe.import_ledger(writer, upload(incoming), "merge")
+    assert summary == {"read": 4, "accepted": 1, "duplicates": 3, "rejected": {}}
+    assert sorted(fe.ledger_amounts(writer.ledger.frame).tolist()) == [10.0, 20.0, 30.0, 40.0]
+
+def test_merge_keeps_repeated_transactions(writer, rows):
+    # عملية مسجلة مرة في السجل ومرتين في الملف: تُضاف النسخة الثانية فقط
+    writer.append(rows([10.0]))
+    incoming = rows([10.0, 10.0], start="2026-01-01").assign(**{"التاريخ": "2026-01-01"})
+    summary = fe.import_ledger(writer, upload(incoming), "merge")
+    assert summary["duplicates"] == 1 and summary["accepted"] == 1
+    assert len(writer.ledger.frame) == 2
+
+def test_merge_ignores_weekday_column(writer, rows):
+    writer.append(rows([10.0]))
+    summary = fe.import_ledger(writer, upload(rows([10.0]).assign(**{"اليوم": "السبت"})), "merge")
+    assert summary["duplicates"] == 1 and summary["accepted"] == 0
+
+def test_invalid_rows_are_rejected(writer, rows):
+    incoming = rows([10.0, 20.0, 30.0]).astype({"المبلغ": object, "التاريخ": object})
+    incoming.loc[0, "التاريخ"] = "ليس تاريخاً"
+    incoming.loc[1, "المبلغ"] = "abc"
+    incoming.loc[2, "المبلغ"] = "1,250.50"
+    summary = fe.import_ledger(writer, upload(incoming), "append")
+    assert summary["accepted"] == 1 and summary["rejected"] == {"تاريخ غير صالح": 1, "مبلغ غير صالح": 1}
+    assert fe.ledger_amounts(writer.ledger.frame).tolist() == [1250.5]
+
+def test_append_adds_duplicates(writer, rows):
+    writer.append(rows([10.0]))
+    assert fe.import_ledger(writer, upload(rows([10.0])), "append")["accepted"] == 1
+    assert len(writer.ledger.frame) == 2
+
+def test_replace_swaps_ledger(writer, rows):
+    writer.append(rows([10.0, 20.0]))
+    fe.import_ledger(writer, upload(rows([5.0])), "replace")
+    assert fe.ledger_amounts(writer.ledger.frame).tolist() == [5.0]
+    assert fe._load_ledger()['المبلغ'].tolist() == [5.0]
+
+def test_replace_with_no_valid_rows_keeps_ledger(writer, rows):
+    writer.append(rows([10.0]))
+    bad = rows([1.0]).astype({"التاريخ": object}).assign(**{"التاريخ": "x"})
+    with pytest.raises(ValueError): fe.import_ledger(writer, upload(bad), "replace")
+    assert len(writer.ledger.frame) == 1
+
+def test_missing_columns_raise(writer, rows):
+    with pytest.raises(ValueError): fe.import_ledger(writer, upload(rows([1.0]).drop(columns=["المبلغ"])), "merge")
+
+def test_xlsx_streams_in_batches(writer, rows, tmp_path, monkeypatch):
+    monkeypatch.setattr(fe, "IMPORT_CHUNK", 3)
+    path = tmp_path / "restore.xlsx"
+    rows([float(i) for i in range(1, 8)]).to_excel(path, index=False)
+    with open(path, 'rb') as f:
+        f.size = path.stat().st_size
+        seen = []
+        summary = fe.import_ledger(writer, f, "merge", progress=lambda frac, s: seen.append(frac))
+    assert summary["accepted"] == 7 and len(seen) == 3 and seen[-1] == 1.0
@@ -0,0 +1,112 @@
+import io, os, shutil
+
+import pandas as pd
+import pytest
+
+import finance_engine as fe
+
+@pytest.fixture
+def csv_store(store, monkeypatch, rows):
+    monkeypatch.setattr(fe, "STORAGE_BACKEND", "csv")
+    fe.save_data(rows([10.0 + i for i in range(20)]))
+    return store
+
+def amounts(df): return sorted(fe.ledger_amounts(df).tolist())
+
+def test_append_goes_to_journal_and_replays(csv_store, rows):
+    base_size = os.path.getsize(fe.DB_FILE)
+    fe.append_rows(rows([500.0, 501.0]))
+    assert os.path.getsize(fe.DB_FILE) == base_size
+    assert os.path.exists(fe.JOURNAL_FILE)
+    df = fe.load_data()
+    assert len(df) == 22 and {500.0, 501.0} <= set(amounts(df))
+
+def test_compact_folds_journal_into_base(csv_store, rows):
+    fe.append_rows(rows([500.0]))
+    fe.compact_journal()
+    assert not os.path.exists(fe.JOURNAL_FILE)
+    assert len(fe._read_base()) == 21 and len(fe.load_data()) == 21
+
+def test_touching_base_keeps_journal(csv_store, rows):
+    fe.append_rows(rows([500.0]))
+    os.utime(fe.DB_FILE, (1, 1))
+    assert len(fe.load_data()) == 21
+    fe.append_rows(rows([501.0]))
+    assert len(fe.load_data()) == 22
+
+def test_interrupted_compaction_does_not_duplicate(csv_store, rows):
+    # الأساسي استُبدل بنسخة فيها صفوف السجل، وانقطع الدمج قبل حذف السجل
+    fe.append_rows(rows([500.0, 500.0]))
+    base = fe._read_base()
+    fe._write_base(pd.concat([base, fe._coerce_ledger(pd.DataFrame(fe._read_journal(base)))], ignore_index=True))
+    assert os.path.exists(fe.JOURNAL_FILE)
+    assert len(fe.load_data()) == 22
+    fe.append_rows(rows([501.0]))
+    assert len(fe.load_data()) == 23 and amounts(fe.load_data()).count(500.0) == 2
+
+def test_interrupted_before_base_replace_keeps_rows(csv_store, rows):
+    # الجيل الجديد كُتب ثم انقطعت الكتابة قبل استبدال الأساسي
+    fe.append_rows(rows([500.0]))
+    fe._write_atomic(fe._gen_file(), "next")
+    assert len(fe.load_data()) == 21
+
+def test_external_restore_replays_journal(csv_store, tmp_path, rows):
+    shutil.copy(fe.DB_FILE, tmp_path / "backup.csv")
+    fe.append_rows(rows([500.0]))
+    shutil.copy(tmp_path / "backup.csv", fe.DB_FILE)
+    assert len(fe.load_data()) == 21
+
+def test_torn_line_is_skipped(csv_store, rows):
+    fe.append_rows(rows([500.0]))
+    with open(fe.JOURNAL_FILE, 'a', encoding='utf-8') as f: f.write('{"التاريخ": "2026-0')
+    assert len(fe.load_data()) == 21
+    fe.append_rows(rows([501.0]))
+    assert len(fe.load_data()) == 22
+
+def test_failed_append_leaves_journal_unchanged(csv_store, monkeypatch, rows):
+    fe.append_rows(rows([500.0]))
+    size = os.path.getsize(fe.JOURNAL_FILE)
+    def broken(fd): raise OSError("disk error")
+    with monkeypatch.context() as m, pytest.raises(OSError):
+        m.setattr(os, "fsync", broken)
+        fe.append_rows(rows([501.0, 502.0]))
+    assert os.path.getsize(fe.JOURNAL_FILE) == size
+
+def test_sqlite_migrates_csv_once(store, monkeypatch, rows):
+    monkeypatch.setattr(fe, "STORAGE_BACKEND", "csv")
+    fe.save_data(rows([1.0, 2.0]))
+    fe.append_rows(rows([3.0]))
+    monkeypatch.setattr(fe, "STORAGE_BACKEND", "sqlite")
+    assert amounts(fe.load_data()) == [1.0, 2.0, 3.0]
+    assert amounts(fe.load_data()) == [1.0, 2.0, 3.0]
+
+def test_journal_keeps_time_of_day(csv_store, rows):
+    fe.append_rows(rows([500.0], start="2026-01-03 14:30"))
+    assert pd.Timestamp("2026-01-03 14:30") in set(fe.load_data()['التاريخ'])
+
+def test_journal_reads_date_only_lines(csv_store, rows):
+    # سطر من سجل كُتب قبل حفظ الوقت، يليه سطر بالوقت كاملاً
+    fe.append_rows(rows([500.0]))
+    with open(fe.JOURNAL_FILE, encoding='utf-8') as f: lines = f.read().splitlines()
+    lines[1] = lines[1].replace("2026-01-01 00:00:00", "2026-01-01")
+    with open(fe.JOURNAL_FILE, 'w', encoding='utf-8') as f: f.write("\n".join(lines) + "\n")
+    fe.append_rows(rows([501.0], start="2026-01-02 09:15"))
+    df = fe.load_data()
+    assert len(df) == 22 and {pd.Timestamp("2026-01-01"), pd.Timestamp("2026-01-02 09:15")} <= set(df['التاريخ'])
+
+def test_reimport_with_times_is_deduplicated(csv_store, rows):
+    data = rows([75.0, 80.0], start="2026-01-03 14:30").assign(**{"التاريخ": ["2026-01-03 14:30", "2026-01-03 18:00"]})
+    data = data.to_csv(index=False).encode('utf-8-sig')
+    def upload():
+        f = io.BytesIO(data)
+        f.name, f.size = "bank.csv", len(data)
+        return f
+    w = fe.LedgerWriter()
+    try: fe.import_ledger(w, upload(), "append")
+    finally: w.close()
+    # بعد إعادة التشغيل يُقرأ السجل من الملف، فيجب أن تبقى البصمة نفسها
+    w = fe.LedgerWriter()
+    try: summary = fe.import_ledger(w, upload(), "merge")
+    finally: w.close()
+    assert summary["accepted"] == 0 and summary["duplicates"] == 2
+    assert len(fe.load_data()) == 22
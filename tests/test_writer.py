@@ -0,0 +1,129 @@
+import json, os, threading
+from concurrent.futures import Future
+
+import pandas as pd
+import pytest
+
+import finance_engine as fe
+
+def test_concurrent_appends_are_all_saved(mirror, writer, rows):
+    def session(k): [writer.append(rows([k * 100.0 + i])) for i in range(10)]
+    ts = [threading.Thread(target=session, args=(k,)) for k in range(8)]
+    for t in ts: t.start()
+    for t in ts: t.join()
+    assert len(writer.ledger.frame) == 80 and len(fe._load_ledger()) == 80
+    assert len(fe._csv_read()) == 80
+
+def test_append_returns_sqlite_ids(writer, rows):
+    ids = writer.append(rows([1.0, 2.0]))
+    assert ids == list(fe._load_ledger().index) == list(writer.ledger.frame.index)
+
+def test_config_patches_merge(writer):
+    writer.update_config({"services": {"ماء": {"date": "2026-01-01", "note": "أ"}}})
+    writer.update_config({"services": {"الغاز": {"date": "2026-01-02", "note": "ب"}}})
+    writer.update_config({"goal": 7000})
+    with open(fe.CONFIG_FILE, encoding='utf-8') as f: saved = json.load(f)
+    assert saved["goal"] == 7000 and set(saved["services"]) == {"ماء", "الغاز"}
+    writer.update_config({"goal": 1}, replace=True)
+    assert fe.load_config() == {"goal": 1}
+
+def test_other_process_writes_are_picked_up(writer, rows):
+    other = fe.LedgerWriter()
+    try:
+        other.append(rows([5.0]))
+        other.update_config({"goal": 123})
+        writer.sync()
+        assert len(writer.ledger.frame) == 1 and writer.config["goal"] == 123
+    finally: other.close()
+
+def test_lock_failure_keeps_writer_running(writer, rows, monkeypatch):
+    with monkeypatch.context() as m:
+        m.setattr(fe, "LOCK_FILE", os.path.join(fe.LOCK_FILE, "missing", "x.lock"))
+        with pytest.raises(OSError): writer.append(rows([1.0]))
+    assert writer._thread.is_alive()
+    writer.append(rows([2.0]))
+    assert fe.ledger_amounts(writer.ledger.frame).tolist() == [2.0]
+
+def test_failed_write_rolls_back_memory(writer, rows, monkeypatch):
+    writer.append(rows([1.0]))
+    def broken(rows): raise OSError("disk error")
+    with monkeypatch.context() as m:
+        m.setattr(fe, "_sql_append", broken)
+        with pytest.raises(OSError): writer.append(rows([2.0]))
+    assert fe.ledger_amounts(writer.ledger.frame).tolist() == [1.0]
+
+def test_mirror_failure_does_not_fail_committed_rows(mirror, writer, rows, monkeypatch):
+    writer.append(rows([1.0]))
+    def broken(rows): raise OSError("disk full")
+    with monkeypatch.context() as m:
+        m.setattr(fe, "_csv_append", broken)
+        writer.append(rows([2.0]))
+    assert isinstance(writer.mirror_error, OSError)
+    assert fe._load_ledger()['المبلغ'].tolist() == [1.0, 2.0]
+    # الدفعة التالية تعيد كتابة النسخة كاملة من sqlite
+    writer.append(rows([3.0]))
+    assert writer.mirror_error is None
+    assert sorted(fe._csv_read()['المبلغ'].tolist()) == [1.0, 2.0, 3.0]
+    assert fe._load_ledger()['المبلغ'].tolist() == [1.0, 2.0, 3.0]
+
+def test_csv_backend_failure_saves_nothing(store, rows, monkeypatch):
+    monkeypatch.setattr(fe, "STORAGE_BACKEND", "csv")
+    w = fe.LedgerWriter()
+    try:
+        w.append(rows([1.0]))
+        def broken(fd): raise OSError("disk error")
+        with monkeypatch.context() as m, pytest.raises(OSError):
+            m.setattr(os, "fsync", broken)
+            w.append(rows([2.0, 3.0]))
+        assert fe._csv_read()['المبلغ'].tolist() == [1.0]
+        assert fe.ledger_amounts(w.ledger.frame).tolist() == [1.0]
+        w.append(rows([4.0]))
+        assert fe._csv_read()['المبلغ'].tolist() == [1.0, 4.0]
+    finally: w.close()
+
+def test_stopped_writer_refuses_requests(store, rows):
+    w = fe.LedgerWriter()
+    w.close()
+    with pytest.raises(RuntimeError): w.append(rows([1.0]))
+
+def test_memory_failure_after_commit_keeps_rows(writer, rows, monkeypatch):
+    # الصفوف حُفظت في sqlite ثم فشل تعديل الذاكرة: الطلب ناجح بمعرفاته، والذاكرة تُعاد من المخزن
+    def broken(*args): raise MemoryError("no memory")
+    with monkeypatch.context() as m:
+        m.setattr(fe.SharedLedger, "append", broken)
+        ids = writer.append(rows([1.0]))
+    assert ids == list(fe._load_ledger().index) == list(writer.ledger.frame.index)
+    assert fe.ledger_amounts(writer.ledger.frame).tolist() == [1.0]
+
+def test_config_write_failure_fails_only_config(writer, rows, monkeypatch):
+    write = fe._write_atomic
+    def broken(path, text):
+        if path == fe.CONFIG_FILE: raise OSError("disk error")
+        write(path, text)
+    append, config = Future(), Future()
+    with monkeypatch.context() as m:
+        m.setattr(fe, "_write_atomic", broken)
+        writer._flush([("append", (rows([1.0]),), append), ("config", ({"goal": 5}, False), config)])
+    assert append.result() == list(fe._load_ledger().index)
+    with pytest.raises(OSError): config.result()
+    assert writer.config.get("goal") != 5 and fe.ledger_amounts(writer.ledger.frame).tolist() == [1.0]
+
+def test_stamp_failure_does_not_fail_committed_rows(writer, rows, monkeypatch):
+    write = fe._write_atomic
+    def broken(path, text):
+        if path == fe.STAMP_FILE: raise OSError("disk error")
+        write(path, text)
+    with monkeypatch.context() as m:
+        m.setattr(fe, "_write_atomic", broken)
+        writer.append(rows([1.0]))
+    writer.append(rows([2.0]))
+    assert fe._load_ledger()['المبلغ'].tolist() == [1.0, 2.0]
+    assert fe._read_stamp() == writer.stamp and fe.ledger_amounts(writer.ledger.frame).tolist() == [1.0, 2.0]
+
+def test_unreadable_csv_is_not_overwritten(store, rows, monkeypatch):
+    monkeypatch.setattr(fe, "STORAGE_BACKEND", "csv")
+    fe.save_data(rows([1.0, 2.0]))
+    with open(fe.DB_FILE, 'a', encoding='utf-8') as f: f.write("a,b,c,d,e,f,g,h\n")
+    with open(fe.DB_FILE, 'rb') as f: before = f.read()
+    with pytest.raises(pd.errors.ParserError): fe.LedgerWriter()
+    with open(fe.DB_FILE, 'rb') as f: assert f.read() == before